@@ -1,116 +1,216 @@
+import glob
+import multiprocessing
 import os
+import time
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 import sys
-
-# Check if the correct number of command-line arguments is provided
-if len(sys.argv) != 2:
-    print("Usage: python view_rfi_data_csv.py <input_name>")
-    sys.exit(1)
-
-input_name = sys.argv[1]
-csv_file_path = input_name + ".csv"
-header_file_path = input_name + "_hdr"
-
-# Check if the files exist
-if not (os.path.isfile(csv_file_path) and os.path.isfile(header_file_path)):
-    print("Files not found:", csv_file_path, header_file_path)
-    sys.exit(1)
-
-# Reading parameters from the header file
-Start_frequency = None
-Stop_frequency = None
-Sweep_points = None
-Sweep_time = None
-Start_time = None
-
-with open(header_file_path, "r") as f:
-    for line in f:
-        if line.startswith("Start frequency:"):
-            Start_frequency = float(line.split(": ")[1].strip())
-        elif line.startswith("Stop frequency:"):
-            Stop_frequency = float(line.split(": ")[1].strip())
-        elif line.startswith("Sweep points:"):
-            Sweep_points = int(line.split(": ")[1].strip())
-        elif line.startswith("Sweep time:"):
-            Sweep_time = float(line.split(": ")[1].strip())
-        elif line.startswith("Start time:"):
-            Start_time = line.split(": ")[1].strip()
-
-
-# Reading data from CSV file
-rfi_df = pd.read_csv(csv_file_path, header=None)
-rfi_data = np.array(rfi_df)
-
-# Convert Start_time to seconds
-# Assumption: Start_time format is HH,MM,SS
-hr, min, sec = map(int, Start_time.split(','))
-start_seconds = hr * 3600 + min * 60 + sec
-
-# Generate time axis labels
-time_labels = []
-for i in range(len(rfi_data)):
-    time_seconds = start_seconds + i * Sweep_time  # Assuming each data point takes Sweep_time
-    hours = int((time_seconds // 3600) % 24)  # Ensure hours do not exceed 24
-    minutes = int((time_seconds // 60) % 60)
-    seconds = int(time_seconds % 60)
-    new_time = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
-    timestamp = pd.to_datetime(new_time, format='%H:%M:%S').strftime('%H,%M,%S')  # Comma separated format
-    time_labels.append(timestamp)
-
-# Modify time labels to switch to the next hour after 59 minutes
-for i in range(1, len(time_labels)):
-    if time_labels[i].split(',')[1] == '00':  # If minutes part is 00
-        if time_labels[i].split(',')[0] == time_labels[i-1].split(',')[0]:  # If hours part remains the same
-            time_labels[i] = time_labels[i].split(',')[0] + ',' + time_labels[i].split(',')[1] + ',' + time_labels[i].split(',')[2]
-
-# Sort the time labels to maintain order
-time_labels_sorted = sorted(time_labels, key=lambda x: pd.to_datetime(x, format='%H,%M,%S'))
-
-# Plotting waterfall plot
-plt.figure(figsize=(12, 8))
-plt.imshow(rfi_data, aspect='auto', vmax=-60, vmin=-90, cmap='inferno', extent=(Start_frequency, Stop_frequency, 0, len(rfi_data)),
-           interpolation='none')
-plt.colorbar(label='dBm')
-plt.title(input_name + "_waterfall", fontsize=18)
-plt.xlabel('Frequency(GHz)', fontsize=14)
-plt.ylabel('Time', fontsize=14)
-
-# Displaying only 8 labels on the y-axis
-num_labels = 8
-plt.yticks(np.linspace(0, len(rfi_data) - 1, num_labels, dtype=int), [time_labels_sorted[i] for i in np.linspace(0, len(rfi_data) - 1, num_labels, dtype=int)], fontsize=8)  # Set time labels and font size
-
-plt.tight_layout()  # Adjust layout for better appearance
-plt.savefig(input_name + "_waterfall.png")
-plt.show()
-
-# Plotting frequency median
-frequency_median = np.median(rfi_data[:, 2:], axis=0)
-plt.figure(figsize=(9, 6))
-plt.plot(np.linspace(Start_frequency, Stop_frequency, len(frequency_median)), frequency_median, linewidth=0.5, label='Frequency Median')
-plt.xlabel('Frequency [GHz]')
-plt.ylabel('Intensity [dBm]')
-plt.title(input_name + "_frequency_median")
-plt.legend(loc='upper right')
-plt.savefig(input_name + '_freq_med.png')
-plt.show()
-
-# Plotting time median
-time_index = np.arange(len(rfi_data))
-time_median = np.median(rfi_data[:, :], axis=1)
-plt.figure(figsize=(9, 6))
-plt.plot(time_index, time_median, linewidth=0.5, label='Time Median')
-plt.xlabel('Time [s]')
-plt.ylabel('Intensity [dBm]')
-plt.title(input_name + "_time_median")
-
-# Displaying only 8 labels on the x-axis
-num_labels = 8
-plt.xticks(np.linspace(0, len(rfi_data) - 1, num_labels, dtype=int), [time_labels_sorted[i] for i in np.linspace(0, len(rfi_data) - 1, num_labels, dtype=int)], rotation=90, fontsize=8)  
-
-plt.legend(loc='upper right')
-plt.savefig(input_name + '_time_med.png')
-plt.show()
-
-
+from time_axis import build_time_axis, tick_labels
+
+
+def read_hdr(header_file_path):
+    """Start/stop frequency, sweep points, sweep time, start time and system date of an HDR file."""
+    hdr = {
+        'Start frequency': None,
+        'Stop frequency': None,
+        'Sweep points': None,
+        'Sweep time': None,
+        'Start time': None,
+        'System date': None,
+    }
+    with open(header_file_path, "r") as f:
+        for line in f:
+            if line.startswith("Start frequency:"):
+                hdr['Start frequency'] = float(line.split(": ")[1].strip())
+            elif line.startswith("Stop frequency:"):
+                hdr['Stop frequency'] = float(line.split(": ")[1].strip())
+            elif line.startswith("Sweep points:"):
+                hdr['Sweep points'] = int(line.split(": ")[1].strip())
+            elif line.startswith("Sweep time:"):
+                hdr['Sweep time'] = float(line.split(": ")[1].strip())
+            elif line.startswith("Start time:"):
+                hdr['Start time'] = line.split(": ")[1].strip()
+            elif line.startswith("System date:"):
+                hdr['System date'] = line.split(": ")[1].strip()
+    return hdr
+
+
+def finish_figure(show):
+    # Interactive runs wait for the window to be closed, batch runs free the figure
+    if show:
+        plt.show()
+    else:
+        plt.close()
+
+
+def render_capture(input_name, show=False):
+    """
+    Saves <input_name>_waterfall.png, <input_name>_freq_med.png and
+    <input_name>_time_med.png of the capture <input_name>.csv with header
+    <input_name>_hdr, showing every plot first when `show` is True.
+
+    Returns the seconds spent on every step, in the order they ran.
+    """
+    timings = {}
+    begin = time.time()
+    hdr = read_hdr(input_name + "_hdr")
+    Start_frequency = hdr['Start frequency']
+    Stop_frequency = hdr['Stop frequency']
+
+    # Reading data from CSV file
+    rfi_df = pd.read_csv(input_name + ".csv", header=None)
+    rfi_data = np.array(rfi_df)
+
+    # Generate the time axis, one timestamp per sweep
+    # Assumption: Start_time format is HH,MM,SS
+    time_axis = build_time_axis(len(rfi_data), hdr['Start time'], hdr['Sweep time'], system_date=hdr['System date'])
+
+    # Displaying only 8 labels on the time axes, formatted as HH,MM,SS
+    num_labels = 8
+    tick_positions, tick_texts = tick_labels(time_axis, num_labels)
+    timings['read'] = time.time() - begin
+
+    # Plotting waterfall plot
+    begin = time.time()
+    plt.figure(figsize=(12, 8))
+    plt.imshow(rfi_data, aspect='auto', vmax=-60, vmin=-90, cmap='inferno', extent=(Start_frequency, Stop_frequency, 0, len(rfi_data)),
+               interpolation='none')
+    plt.colorbar(label='dBm')
+    plt.title(os.path.basename(input_name) + "_waterfall", fontsize=18)
+    plt.xlabel('Frequency(GHz)', fontsize=14)
+    plt.ylabel('Time', fontsize=14)
+
+    # Displaying only 8 labels on the y-axis
+    plt.yticks(tick_positions, tick_texts, fontsize=8)  # Set time labels and font size
+
+    plt.tight_layout()  # Adjust layout for better appearance
+    plt.savefig(input_name + "_waterfall.png")
+    timings['waterfall'] = time.time() - begin
+    finish_figure(show)
+
+    # Plotting frequency median
+    begin = time.time()
+    frequency_median = np.median(rfi_data[:, 2:], axis=0)
+    plt.figure(figsize=(9, 6))
+    plt.plot(np.linspace(Start_frequency, Stop_frequency, len(frequency_median)), frequency_median, linewidth=0.5, label='Frequency Median')
+    plt.xlabel('Frequency [GHz]')
+    plt.ylabel('Intensity [dBm]')
+    plt.title(os.path.basename(input_name) + "_frequency_median")
+    plt.legend(loc='upper right')
+    plt.savefig(input_name + '_freq_med.png')
+    timings['freq_med'] = time.time() - begin
+    finish_figure(show)
+
+    # Plotting time median
+    begin = time.time()
+    time_index = np.arange(len(rfi_data))
+    time_median = np.median(rfi_data[:, :], axis=1)
+    plt.figure(figsize=(9, 6))
+    plt.plot(time_index, time_median, linewidth=0.5, label='Time Median')
+    plt.xlabel('Time [s]')
+    plt.ylabel('Intensity [dBm]')
+    plt.title(os.path.basename(input_name) + "_time_median")
+
+    # Displaying only 8 labels on the x-axis
+    plt.xticks(tick_positions, tick_texts, rotation=90, fontsize=8)
+
+    plt.legend(loc='upper right')
+    plt.savefig(input_name + '_time_med.png')
+    timings['time_med'] = time.time() - begin
+    finish_figure(show)
+    return timings
+
+
+def is_pattern(name):
+    # A folder or a name with glob wildcards, as opposed to a single capture
+    return os.path.isdir(name) or any(c in name for c in '*?[')
+
+
+def find_inputs(pattern):
+    """
+    Input names (CSV path without .csv) of the captures in a folder or
+    matching a glob, skipping CSV files without a NAME_hdr next to them.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.csv')
+    inputs = []
+    for csv_file_path in sorted(glob.glob(pattern)):
+        input_name, ext = os.path.splitext(csv_file_path)
+        if ext != '.csv':
+            continue
+        if not os.path.isfile(input_name + "_hdr"):
+            print("Header not found, skipped:", input_name + "_hdr")
+            continue
+        inputs.append(input_name)
+    return inputs
+
+
+def use_agg():
+    # Figures of the batch workers are only saved, no window is ever opened
+    plt.switch_backend('Agg')
+
+
+def render_job(input_name):
+    """render_capture for a process pool: returns (input_name, timings, error, seconds)."""
+    begin = time.time()
+    try:
+        return input_name, render_capture(input_name), None, time.time() - begin
+    except Exception as e:
+        plt.close('all')
+        return input_name, None, str(e), time.time() - begin
+
+
+def render_batch(inputs, processes=None):
+    """
+    Renders the plots of every capture in `inputs` on the Agg backend, one
+    capture per worker process, printing the timings of every capture as it
+    finishes. Returns the number of captures that failed.
+    """
+    begin = time.time()
+    failed = 0
+    with multiprocessing.Pool(processes, initializer=use_agg) as pool:
+        for input_name, timings, error, seconds in pool.imap_unordered(render_job, inputs):
+            if error is not None:
+                failed += 1
+                print("{}: failed after {:.1f} s, {}".format(input_name, seconds, error))
+                continue
+            steps = ", ".join("{} {:.1f} s".format(step, t) for step, t in timings.items())
+            print("{}: {:.1f} s ({})".format(input_name, seconds, steps))
+    print("{} captures rendered, {} failed, in {:.1f} s".format(len(inputs) - failed, failed, time.time() - begin))
+    return failed
+
+
+if __name__ == '__main__':
+    # Check if the correct number of command-line arguments is provided
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python view_rfi_data_csv.py <input_name>")
+        print("       python view_rfi_data_csv.py <folder_or_glob> [processes]")
+        sys.exit(1)
+
+    input_name = sys.argv[1]
+
+    # A folder or a glob (quoted, e.g. "captures/*.csv") renders a batch without windows
+    if is_pattern(input_name):
+        matplotlib.use('Agg')
+        inputs = find_inputs(input_name)
+        if not inputs:
+            print("No captures found:", input_name)
+            sys.exit(1)
+        processes = int(sys.argv[2]) if len(sys.argv) == 3 else None
+        sys.exit(1 if render_batch(inputs, processes) else 0)
+
+    if len(sys.argv) != 2:
+        print("Usage: python view_rfi_data_csv.py <input_name>")
+        sys.exit(1)
+
+    csv_file_path = input_name + ".csv"
+    header_file_path = input_name + "_hdr"
+
+    # Check if the files exist
+    if not (os.path.isfile(csv_file_path) and os.path.isfile(header_file_path)):
+        print("Files not found:", csv_file_path, header_file_path)
+        sys.exit(1)
+
+    render_capture(input_name, show=True)
@@ -5,6 +5,7 @@ import plotly
 import plotly.graph_objs as go
 import json
 import os
+from time_axis import build_time_axis
 
 app = Flask(__name__)
 
@@ -78,6 +79,7 @@ def visualize():
         Sweep_points = None
         Sweep_time = None
         Start_time = None
+        System_date = None
 
         # Reading frequency and time metadata
         hdr_content = request.json['hdrContent']
@@ -93,21 +95,11 @@ def visualize():
                 Sweep_time = float(line.split(": ")[1].strip())
             elif line.startswith("Start time:"):
                 Start_time = line.split(": ")[1].strip()
+            elif line.startswith("System date:"):
+                System_date = line.split(": ")[1].strip()
 
-        # Convert Start_time to seconds
-        # Assumption: Start_time format is HH,MM,SS
-        hr, min, sec = map(int, Start_time.split(','))
-        start_seconds = hr * 3600 + min * 60 + sec
-
-        # Generate time axis labels
-        time_labels = []
-        for i in range(len(rfi_data)):
-            time_seconds = start_seconds + i * Sweep_time  # Assuming each data point takes Sweep_time
-            hours = int((time_seconds // 3600) % 24)  # Ensure hours do not exceed 24
-            minutes = int((time_seconds // 60) % 60)
-            seconds = int(time_seconds % 60)
-            new_time = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
-            time_labels.append(new_time)
+        # Generate the time axis, one timestamp per sweep
+        time_labels = build_time_axis(len(rfi_data), Start_time, Sweep_time, system_date=System_date)
 
         # Plotting waterfall plot
         f_start = Start_frequency
@@ -0,0 +1,212 @@
+import queue
+import socket
+import threading
+import time
+
+import numpy as np
+
+
+class ScpiInstrument:
+    """
+    SCPI connection to a spectrum analyzer over raw TCP (port 5025).
+
+    Written against the Keysight N9915A (FieldFox) in spectrum analyzer
+    mode: traces are read as ASCII comma separated dBm values, the
+    'Data form: ASC,0' of the HDR files.
+    """
+
+    def __init__(self, host, port=5025, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self._reader = self.sock.makefile('rb')
+
+    def write(self, command):
+        self.sock.sendall((command + '\n').encode('ascii'))
+
+    def query(self, command):
+        self.write(command)
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('Instrument at {}:{} closed the connection'.format(self.host, self.port))
+        return line.decode('ascii').strip()
+
+    def configure(self, start_frequency=None, stop_frequency=None, sweep_points=None, sweep_time=None):
+        """Single sweep mode with ASCII traces, plus the given settings."""
+        self.write('INIT:CONT OFF')
+        self.write('FORM:DATA ASC,0')
+        if start_frequency is not None:
+            self.write('SENS:FREQ:STAR {}'.format(start_frequency))
+        if stop_frequency is not None:
+            self.write('SENS:FREQ:STOP {}'.format(stop_frequency))
+        if sweep_points is not None:
+            self.write('SENS:SWE:POIN {}'.format(int(sweep_points)))
+        if sweep_time is not None:
+            self.write('SENS:SWE:TIME {}'.format(sweep_time))
+        # Waits until the settings are applied
+        self.query('*OPC?')
+
+    def settings(self):
+        """HDR fields of the current instrument settings."""
+        return {
+            'Instrument ID': self.query('*IDN?'),
+            'Start frequency': float(self.query('SENS:FREQ:STAR?')),
+            'Stop frequency': float(self.query('SENS:FREQ:STOP?')),
+            'Sweep points': int(float(self.query('SENS:SWE:POIN?'))),
+        }
+
+    def read_sweep(self):
+        """Triggers one sweep, waits for it and returns the trace as float32."""
+        self.query('INIT:IMM;*OPC?')
+        return np.fromstring(self.query('TRAC1:DATA?'), dtype=np.float32, sep=',')
+
+    def close(self):
+        self._reader.close()
+        self.sock.close()
+
+
+class AcquisitionService:
+    """
+    Reads sweeps from an instrument in a background thread and hands them to
+    `sink` (e.g. the portal's append_sweeps) from a second thread.
+
+    Sweep i is triggered at start + i * sweep_time, the timing the HDR time
+    axis assumes. When the reads fall more than half a sweep behind, an
+    overrun is counted and the reads continue at the next slot of that
+    schedule, so every sweep keeps the time the axis gives it.
+
+    The two threads are joined by a queue of at most `queue_sweeps` sweeps,
+    written to the sink in blocks of up to `batch_sweeps`. When the sink
+    falls behind and the queue is full, 'block' backpressure pauses the
+    reads (the instrument is not triggered) and 'drop' discards the new
+    sweeps; both are counted in status().
+
+    The instrument settings for the HDR are read when the service is
+    created, so an instrument that does not answer fails there, before
+    anything was started.
+
+    Slots without a sweep (overruns, paused reads, dropped sweeps) are
+    written as all-NaN sweeps and counted as 'missing', so that row i of
+    the live capture is always the sweep of slot i.
+    """
+
+    def __init__(self, instrument, sink, sweep_time=1.0, queue_sweeps=1024, batch_sweeps=256, backpressure='block'):
+        if backpressure not in ('block', 'drop'):
+            raise ValueError('Unknown backpressure policy: ' + str(backpressure))
+        self.instrument = instrument
+        self.sink = sink
+        self.sweep_time = float(sweep_time)
+        self.batch_sweeps = batch_sweeps
+        self.backpressure = backpressure
+        self.sweeps = queue.Queue(maxsize=queue_sweeps)
+        self.hdr = instrument.settings()
+        self.hdr['Sweep time'] = self.sweep_time
+        self.started = None
+        self.counts = {'read': 0, 'written': 0, 'dropped': 0, 'missing': 0, 'overruns': 0, 'blocked_seconds': 0.0}
+        self.last_sweep = None
+        self.error = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.started = time.time()
+        self._schedule_start = time.monotonic()
+        self._threads = [threading.Thread(target=self._read_loop, daemon=True),
+                         threading.Thread(target=self._write_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stops reading, writes the queued sweeps and closes the instrument."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.instrument.close()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _read_loop(self):
+        slot = 0
+        try:
+            while not self._stop.is_set():
+                delay = self._schedule_start + slot * self.sweep_time - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+                sweep = self.instrument.read_sweep()
+                self.last_sweep = time.time()
+                self.counts['read'] += 1
+                self._enqueue((slot, sweep))
+                slot += 1
+                if self.sweep_time > 0:
+                    late = time.monotonic() - (self._schedule_start + slot * self.sweep_time)
+                    if late > self.sweep_time / 2:
+                        # The slots passed meanwhile are left empty
+                        self.counts['overruns'] += 1
+                        slot += int(np.ceil(late / self.sweep_time))
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._stop.set()
+
+    def _enqueue(self, sweep):
+        if self.backpressure == 'drop':
+            try:
+                self.sweeps.put_nowait(sweep)
+            except queue.Full:
+                self.counts['dropped'] += 1
+            return
+        blocked = time.monotonic()
+        while True:
+            try:
+                self.sweeps.put(sweep, timeout=0.5)
+                break
+            except queue.Full:
+                if self._stop.is_set():
+                    self.counts['dropped'] += 1
+                    break
+        self.counts['blocked_seconds'] += time.monotonic() - blocked
+
+    def _write_loop(self):
+        next_slot = 0
+        try:
+            # Until the reader has stopped and everything it read is written
+            while self._threads[0].is_alive() or not self.sweeps.empty():
+                try:
+                    batch = [self.sweeps.get(timeout=0.5)]
+                except queue.Empty:
+                    continue
+                while len(batch) < self.batch_sweeps:
+                    try:
+                        batch.append(self.sweeps.get_nowait())
+                    except queue.Empty:
+                        break
+                rows = []
+                for slot, sweep in batch:
+                    if slot > next_slot:
+                        rows.extend([np.full_like(sweep, np.nan)] * (slot - next_slot))
+                        self.counts['missing'] += slot - next_slot
+                    rows.append(sweep)
+                    next_slot = slot + 1
+                self.sink(np.stack(rows))
+                self.counts['written'] += len(batch)
+        except Exception as e:
+            self.error = str(e)
+            self._stop.set()
+
+    def hdr_content(self):
+        """HDR text of the acquisition, in the format of the instrument's _hdr files."""
+        if self.started is None:
+            return None
+        started = time.localtime(self.started)
+        fields = dict(self.hdr)
+        fields['System date'] = '{},{},{}'.format(started.tm_year, started.tm_mon, started.tm_mday)
+        fields['Data form'] = 'ASC,0'
+        fields['Start time'] = '{},{},{}'.format(started.tm_hour, started.tm_min, started.tm_sec)
+        return '\n'.join('{}: {}'.format(key, value) for key, value in fields.items()) + '\n'
+
+    def status(self):
+        return dict(self.counts, running=self.running, queued=self.sweeps.qsize(), error=self.error,
+                    started=self.started, last_sweep=self.last_sweep, sweep_time=self.sweep_time,
+                    backpressure=self.backpressure)
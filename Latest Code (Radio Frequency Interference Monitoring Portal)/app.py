@@ -1,24 +1,233 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import pandas as pd
+from flask import Flask, render_template, request, jsonify, send_from_directory, make_response, Response, stream_with_context, g, session
 import numpy as np
 import plotly
 import plotly.graph_objs as go
+import base64
+import hashlib
 import json
 import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
+from capture_store import data_path, find_hdr, load_capture, open_capture, parse_hdr, read_meta, remove_capture, store_version
+from catalog import Catalog
+from compare import common_grid, difference_waterfall, frequency_axis, interpolate_columns, sweep_seconds
+from time_axis import build_time_axis
+from pyramid import build_pyramid, decimate, fit_factors, has_pyramid, open_level, pick_level, pool, remove_pyramid
+from tiles import read_tile, tile_etag, tile_info
+from transfer import ENCODINGS, encode_axis, encode_matrix, tile_bytes
+from raster import render_png
+from product_cache import ProductCache
+from dataset_cache import DatasetCache
+from flagging import THRESHOLD, channel_statistics, clean_median, flag_capture, flag_fraction, flag_params, flag_stored, open_flags, remove_flags
+from quantile_sketch import QuantileSketch, row_median, sketch_capture
+from live_buffer import LiveBuffer, ReadWriteLock, RollingBuffer
+from acquisition import AcquisitionService, ScpiInstrument
+from replay import CaptureReplay
+from metrics import Registry
+
+def shared_secret_key(path):
+    # Random key created by the first server process started in this folder and
+    # read by all the others, so a session cookie is valid in every worker
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for attempt in range(50):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if len(key) == 32:
+                return key
+            time.sleep(0.1)  # Still being written by the process that created it
+        raise RuntimeError('Invalid secret key file: ' + path)
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
 
 app = Flask(__name__)
+# Signs the session cookie, which holds each operator's dataset and y-axis label.
+# Every server process must use the same key: RFI_PORTAL_SECRET_KEY, or else
+# the key kept in SECRET_KEY_PATH.
+app.config['SECRET_KEY_PATH'] = 'secret_key'
+app.config['SECRET_KEY'] = os.environ.get('RFI_PORTAL_SECRET_KEY') or shared_secret_key(app.config['SECRET_KEY_PATH'])
 app.config['MAX_CONTENT_LENGTH'] = 10000 * 1024 * 1024  # 10000 MB max upload size (10 GB)
 app.config['UPLOAD_FOLDER'] = 'Dataset'
+app.config['STORE_FOLDER'] = 'Store'  # Binary copies of the uploaded captures (see capture_store.py)
+app.config['STORE_DTYPE'] = 'float32'  # 'float16' halves the store size at ~0.03 dB resolution
+app.config['CATALOG_PATH'] = 'catalog.sqlite'  # Index of the captures and HDR files on disk (see catalog.py)
+app.config['HDR_FOLDERS'] = [os.path.join(os.path.expanduser('~'), 'Downloads')]  # Indexed with the upload folder
+app.config['PYRAMID_POOLING'] = ('max', 'mean', 'median')  # Waterfall levels precomputed at upload (see pyramid.py)
+app.config['VIEWPORT_ROWS'] = 1200  # Default size of the waterfall sent to the browser
+app.config['VIEWPORT_COLS'] = 1001
+app.config['WATERFALL_ZMIN'] = -90  # Colour range of the waterfall in dBm, also the range
+app.config['WATERFALL_ZMAX'] = -60  # the compact 'u8' transfer mode is quantized against
+app.config['DATASET_CACHE_BYTES'] = 4 * 2**30  # Captures mapped at once, least recently used ones are closed
+app.config['PRODUCT_CACHE_BYTES'] = 512 * 2**20  # Medians, sketches, masks and figures kept in memory
+app.config['COMPARE_ZRANGE'] = 10  # Colour range of the difference waterfall, +-dB
+app.config['EXACT_MEDIAN_MAX_ROWS'] = 100000  # Larger datasets get spectra from a streaming sketch
+app.config['LIVE_EVENT_INTERVAL'] = 0.5  # Minimum seconds between two /live_events updates
+app.config['LIVE_ROLLING_ROWS'] = None  # Sweeps kept in memory while streaming, None keeps them all
+app.config['LIVE_SEGMENT_ROWS'] = 100000  # Sweeps per store segment of a rolling live buffer
+app.config['ACQUISITION_QUEUE_SWEEPS'] = 1024  # Sweeps read ahead of the live buffer (see acquisition.py)
+app.config['ACQUISITION_BACKPRESSURE'] = 'block'  # 'block' pauses the instrument, 'drop' discards sweeps
+
+# Global variables. What each operator is looking at lives in their session
+# (see session_dataset), so these are only shared, thread-safe resources.
+# Read-only memmaps of the captures opened by this process, reopened from the store after an
+# eviction or when the capture was stored again by another process
+datasets = DatasetCache(lambda name: open_stored(name), app.config['DATASET_CACHE_BYTES'],
+                        version=lambda name: store_version(app.config['STORE_FOLDER'], name))
+products = ProductCache(app.config['PRODUCT_CACHE_BYTES'])  # Medians, time axes and figures per dataset, see product_cache.py
+# The live capture is held in the memory of the process that receives the
+# sweeps (/stream_data, /acquisition, /replay) and is only seen by that process.
+# With several server processes, route those and /live_events to a single one;
+# the segments a rolling live buffer spills to the store are seen by all of them.
+LIVE = 'live'  # Dataset name of the streamed sweeps
+live_buffer = None  # LiveBuffer or RollingBuffer of the streamed sweeps
+live_sketch = None  # Per-channel quantile sketch of the streamed sweeps, see quantile_sketch.py
+live_feed = 0  # Number of the current live capture, incremented by every new one
+live_hdr_content = None  # HDR text of the live capture when known, written into its store segments
+live_lock = ReadWriteLock()  # Held for writing by appends, for reading by snapshots
+live_updated = threading.Condition()  # Notified when sweeps are appended or a new live capture starts
+catalog = None  # Opened on first use, see get_catalog
+acquisition = None  # AcquisitionService reading an instrument into the live buffer
+replay = None  # CaptureReplay feeding a stored capture into the live buffer
+
+# Served at /metrics in the Prometheus text format, see metrics.py
+metrics = Registry()
+request_seconds = metrics.histogram('rfi_request_seconds', 'Time to handle a request', ('endpoint', 'status'))
+stage_seconds = metrics.histogram('rfi_stage_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage'))
+
+# Ensure the upload and store folders exist
+for folder in [app.config['UPLOAD_FOLDER'], app.config['STORE_FOLDER']]:
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+# Immutable view of the live capture at one moment, appends never modify its arrays.
+# sketch() gives the quantile sketch of its sweeps.
+LiveSnapshot = namedtuple('LiveSnapshot', ['buffer', 'feed', 'data', 'first_row', 'rows', 'sketch'])
+
+@contextmanager
+def timed_stage(stage):
+    # Adds the time spent in the block to the stage's total for this request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault('stage_timings', {})
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_timings(response):
+    # Stage totals go to the histograms and, for the browser's network panel, to Server-Timing
+    endpoint = request.endpoint or 'unknown'
+    timings = g.get('stage_timings', {})
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, (endpoint, stage))
+    request_seconds.observe(time.perf_counter() - g.request_start, (endpoint, response.status_code))
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.1f}'.format(stage, seconds * 1000) for stage, seconds in timings.items())
+    return response
+
+def get_catalog():
+    global catalog
+
+    if catalog is None or catalog.path != app.config['CATALOG_PATH']:
+        catalog = Catalog(app.config['CATALOG_PATH'])
+    return catalog
+
+def catalog_folders():
+    return [app.config['UPLOAD_FOLDER']] + list(app.config['HDR_FOLDERS'])
+
+def find_hdr_file(base_name):
+    # The HDR file is looked up next to the uploaded CSV first, then in the
+    # catalog of the HDR folders, which /catalog/scan keeps up to date
+    hdr_file_path = find_hdr(os.path.join(app.config['UPLOAD_FOLDER'], base_name + '.csv'))
+    if hdr_file_path is not None:
+        return hdr_file_path
+    hdr_file_path = get_catalog().find_hdr(base_name)
+    if hdr_file_path is None:
+        # Perhaps saved since the last scan. Only folders whose mtime changed
+        # are listed again, so uploads without any HDR cost a stat per folder
+        get_catalog().scan_hdr(app.config['HDR_FOLDERS'])
+        hdr_file_path = get_catalog().find_hdr(base_name)
+    return hdr_file_path
+
+def is_store_name(name):
+    # Uploads are stored under their secure_filename, so a name it would change
+    # (a path, '..', ...) is never a capture and must not reach the store folder
+    return isinstance(name, str) and name != '' and secure_filename(name) == name
 
-# Global variables
-datasets = {}
-current_dataset = None
-current_y_label = 'Time'  # Default y-axis label
+def open_stored(name):
+    # Memmap of a stored capture. The store is shared, so any thread or server
+    # process can serve any uploaded capture.
+    if not is_store_name(name) or read_meta(app.config['STORE_FOLDER'], name) is None:
+        return None
+    return open_capture(app.config['STORE_FOLDER'], name)[0]
 
-# Ensure the upload folder exists
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
+def get_dataset(name):
+    # Names come from requests and sessions, only stored captures are looked up
+    if not is_store_name(name):
+        return None
+    # Products of a capture another process uploaded again or removed are stale
+    products.validate(name, store_version(app.config['STORE_FOLDER'], name))
+    return datasets.get(name)
+
+def session_dataset():
+    # Dataset of this request: given explicitly, or the one this session last loaded
+    settings = request.get_json(silent=True) if request.is_json else None
+    return (settings or {}).get('dataset') or request.args.get('dataset') or session.get('dataset')
+
+def live_snapshot():
+    # The streamed sweeps so far, None before any sweep was streamed
+    with live_lock.read():
+        if live_buffer is None or len(live_buffer) == 0:
+            return None
+        buffer, feed = live_buffer, live_feed
+        first_row, rows = buffer.first_row, len(buffer)
+        view = buffer.snapshot()
+    # Sweeps are gathered into one array after the lock is released, appends need not wait for it
+    data = view()
+    sketches = []
+
+    def sketch():
+        # Only copied when a product is computed, not for responses found in the cache
+        if not sketches:
+            copied = live_sketch_at(buffer, rows)
+            sketches.append(copied if copied is not None else sketch_capture(data))
+        return sketches[0]
+    return LiveSnapshot(buffer, feed, data, first_row, rows, sketch)
+
+def live_sketch_at(buffer, rows):
+    # Copy of the live sketch as it was at `rows` sweeps of `buffer`: the sweeps
+    # appended since are taken out again. None if the buffer was replaced or
+    # those sweeps have rolled out of memory.
+    with live_lock.read():
+        if live_buffer is not buffer:
+            return None
+        newer = buffer.rows(rows)
+        if rows + len(newer) != len(buffer):
+            return None
+        sketch = live_sketch.copy()
+    if len(newer):
+        sketch.subtract(sketch_capture(newer))
+    return sketch
+
+def datasets_meta(name):
+    # Sidecar of a stored capture with a waterfall pyramid, None otherwise
+    if not is_store_name(name):
+        return None
+    meta = read_meta(app.config['STORE_FOLDER'], name)
+    if meta is None or 'pyramid' not in meta:
+        return None
+    return meta
 
 @app.route("/")
 def home():
@@ -30,8 +239,6 @@ def chart():
 
 @app.route('/upload_dataset', methods=['POST'])
 def upload_dataset():
-    global datasets, current_dataset
-
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'})
 
@@ -44,217 +251,832 @@ def upload_dataset():
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
     try:
-        file.save(file_path)
+        with timed_stage('save'):
+            file.save(file_path)
     except Exception as e:
         return jsonify({'error': str(e)})
 
-    try:
-        chunk_list = []
-        for chunk in pd.read_csv(file_path, chunksize=1000000):
-            chunk_list.append(chunk.select_dtypes(include=['number']))
-        current_dataset = pd.concat(chunk_list, ignore_index=True)
-        datasets[filename] = current_dataset
-    except Exception as e:
-        return jsonify({'error': 'Failed to load dataset: ' + str(e)})
-
-    downloads_folder = os.path.join(os.path.expanduser('~'), 'Downloads')
     base_name = os.path.splitext(filename)[0]
-    hdr_file_path = None
-    for ext in ['_hdr', '.txt']:
-        potential_path = os.path.join(downloads_folder, base_name + ext)
-        if os.path.isfile(potential_path):
-            hdr_file_path = potential_path
-            break
+    hdr_file_path = find_hdr_file(base_name)
+    hdr_content = None
+    hdr_error = None
 
-    hdr_found = hdr_file_path is not None
-
-    if hdr_found:
+    if hdr_file_path is not None:
         try:
             with open(hdr_file_path, 'r') as f:
                 hdr_content = f.read()
-            return jsonify({'success': 'Dataset uploaded successfully', 'hdr_content': hdr_content, 'hdr_found': True})
         except Exception as e:
-            return jsonify({'success': 'Dataset uploaded, but failed to read HDR file: ' + str(e), 'hdr_found': False})
+            hdr_error = str(e)
+
+    try:
+        # Converted once into the binary store, then opened as a read-only memmap.
+        # A new conversion replaces the store file, readers of the old one are unaffected.
+        with timed_stage('csv_parse'):
+            data, meta = load_capture(file_path, app.config['STORE_FOLDER'], filename,
+                                      hdr_content=hdr_content, dtype=app.config['STORE_DTYPE'])
+        products.invalidate(filename)
+        if not has_pyramid(meta, app.config['PYRAMID_POOLING']):
+            with timed_stage('pyramid'):
+                build_pyramid(app.config['STORE_FOLDER'], filename, modes=app.config['PYRAMID_POOLING'])
+        datasets.put(filename, data)
+        session['dataset'] = filename
+        get_catalog().add(file_path, hdr_file_path, store_folder=app.config['STORE_FOLDER'], store_name=filename)
+    except Exception as e:
+        return jsonify({'error': 'Failed to load dataset: ' + str(e)})
+
+    if hdr_error is not None:
+        return jsonify({'success': 'Dataset uploaded, but failed to read HDR file: ' + hdr_error, 'hdr_found': False})
+    elif hdr_content is not None:
+        return jsonify({'success': 'Dataset uploaded successfully', 'hdr_content': hdr_content, 'hdr_found': True})
     else:
         return jsonify({'success': 'Dataset uploaded successfully', 'hdr_content': 'There is no HDR File uploaded.', 'hdr_found': False})
 
 @app.route('/remove_dataset', methods=['POST'])
 def remove_dataset():
-    global datasets
-
     filename = request.form.get('filename')
 
-    if filename in datasets:
-        del datasets[filename]
+    if filename != LIVE and get_dataset(filename) is not None:
+        datasets.pop(filename)
+        store_path = data_path(app.config['STORE_FOLDER'], filename, read_meta(app.config['STORE_FOLDER'], filename))
+        remove_pyramid(app.config['STORE_FOLDER'], filename)
+        remove_flags(app.config['STORE_FOLDER'], filename)
+        remove_capture(app.config['STORE_FOLDER'], filename)
+        get_catalog().forget_store(store_path)
+        products.invalidate(filename)
+        if session.get('dataset') == filename:
+            session.pop('dataset')
         return jsonify({'success': 'Dataset removed successfully'})
     else:
         return jsonify({'error': 'Dataset not found'})
 
 @app.route('/download_dataset/<filename>')
 def download_dataset(filename):
-    if filename in datasets:
+    if get_dataset(filename) is not None:
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
     else:
         return jsonify({'error': 'Dataset not found'})
 
+def register_segment(name):
+    # Sweeps rolled out of the live buffer stay available like an uploaded capture
+    datasets.put(name, open_capture(app.config['STORE_FOLDER'], name)[0])
+
+def new_live_buffer(n_channels, seed=None, hdr_content=None):
+    # A live capture continues `seed` (a capture the operator was viewing) when given
+    rolling_rows = app.config['LIVE_ROLLING_ROWS']
+    if not rolling_rows:
+        # The seed's sweeps are only read from the store when a view needs them
+        return LiveBuffer(n_channels, dtype=app.config['STORE_DTYPE'], seed=seed)
+    # Older sweeps of an uploaded capture are in the store already, only the
+    # last rolling_rows are carried over
+    tail = seed[-rolling_rows:] if seed is not None else None
+    buffer = RollingBuffer(n_channels, rolling_rows, app.config['STORE_FOLDER'], dtype=app.config['STORE_DTYPE'],
+                           segment_rows=app.config['LIVE_SEGMENT_ROWS'],
+                           start_row=len(seed) - len(tail) if seed is not None else 0,
+                           on_segment=register_segment, hdr_content=hdr_content)
+    if tail is not None:
+        buffer.append(tail)
+    return buffer
+
+def check_sweep_width(sweeps, n_channels):
+    if sweeps.shape[1] != n_channels:
+        raise ValueError('Expected {} values per sweep, got {}'.format(n_channels, sweeps.shape[1]))
+
+def append_sweeps(sweeps, seed=None):
+    # Appends a (rows, channels) block to the live buffer, O(rows) whatever its size.
+    # Readers work on snapshots, so they only wait for the append itself.
+    # A new live capture continues the stored capture named `seed` when given.
+    global live_buffer, live_sketch, live_feed, live_hdr_content
+
+    seed_data = seed_hdr = seed_sketch = None
+    if seed is not None and live_buffer is None:
+        # Reading the whole seed is left out of the lock
+        seed_data = get_dataset(seed)
+        if seed_data is not None:
+            check_sweep_width(sweeps, seed_data.shape[1])
+            seed_hdr = (read_meta(app.config['STORE_FOLDER'], seed) or {}).get('hdr_content')
+            seed_sketch = sketch_capture(seed_data)
+    with live_lock.write():
+        buffer, sketch = live_buffer, live_sketch
+        if buffer is None:
+            buffer = new_live_buffer(sweeps.shape[1], seed_data, seed_hdr if seed_data is not None else live_hdr_content)
+            sketch = seed_sketch if seed_sketch is not None else QuantileSketch(sweeps.shape[1])
+        # Nothing is changed by sweeps of the wrong width, and the sketch is
+        # updated first so that it never counts sweeps the buffer lacks
+        check_sweep_width(sweeps, buffer.n_channels)
+        sketch.update(sweeps)
+        buffer.append(sweeps)
+        if buffer is not live_buffer:
+            if seed_data is not None:
+                live_hdr_content = seed_hdr
+            live_buffer, live_sketch = buffer, sketch
+            live_feed += 1
+        rows = len(live_buffer)
+    with live_updated:
+        live_updated.notify_all()
+    return rows
+
+def stream_seed():
+    # Streaming into a session that shows an uploaded capture continues that capture
+    name = session.get('dataset')
+    if live_buffer is not None or name in (None, LIVE):
+        return None
+    return name
+
 @app.route('/stream_data', methods=['POST'])
 def stream_data():
-    global current_dataset
-
     data = request.get_json()
+    values = list(data.values()) if isinstance(data, dict) else data
 
-    if current_dataset is None:
-        current_dataset = pd.DataFrame(columns=data.keys())
-
-    new_data = pd.DataFrame([data])
-    current_dataset = pd.concat([current_dataset, new_data], ignore_index=True)
+    try:
+        append_sweeps(np.asarray(values, dtype=app.config['STORE_DTYPE'])[np.newaxis, :], seed=stream_seed())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    session['dataset'] = LIVE
     return jsonify({'success': True})
 
+@app.route('/stream_data_bulk', methods=['POST'])
+def stream_data_bulk():
+    # Many sweeps per request: a JSON array of sweeps (lists or dicts), or a raw
+    # little-endian float32 body with the sweep length in the X-Sweep-Points header
+    try:
+        if request.mimetype == 'application/octet-stream':
+            sweep_points = int(request.headers.get('X-Sweep-Points', 0)) or (
+                live_buffer.n_channels if live_buffer is not None else 0)
+            if sweep_points <= 0:
+                return jsonify({'error': 'X-Sweep-Points header required'})
+            sweeps = np.frombuffer(request.get_data(), dtype='<f4').reshape(-1, sweep_points)
+        else:
+            data = request.get_json()
+            sweeps = np.asarray([list(row.values()) if isinstance(row, dict) else row for row in data],
+                                dtype=app.config['STORE_DTYPE'])
+        if sweeps.ndim != 2 or len(sweeps) == 0:
+            return jsonify({'error': 'Expected a non-empty list of sweeps'})
+        rows = append_sweeps(sweeps, seed=stream_seed())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    session['dataset'] = LIVE
+    return jsonify({'success': True, 'appended': len(sweeps), 'rows': rows})
+
+def set_live_hdr(hdr_content):
+    # HDR of the live capture, e.g. known only once an acquisition has started
+    global live_hdr_content
+
+    with live_lock.write():
+        live_hdr_content = hdr_content
+        if isinstance(live_buffer, RollingBuffer):
+            live_buffer.hdr_content = hdr_content
+
+def reset_live():
+    # The next appended sweeps start a new live capture
+    global live_buffer, live_sketch, live_hdr_content
+
+    for source in [acquisition, replay]:
+        if source is not None and source.running:
+            source.stop()
+    with live_lock.write():
+        if isinstance(live_buffer, RollingBuffer):
+            live_buffer.close()
+        live_buffer = None
+        live_sketch = None
+        live_hdr_content = None
+    with live_updated:
+        live_updated.notify_all()
+
+@app.route('/acquisition/start', methods=['POST'])
+def acquisition_start():
+    # Starts a new live capture read from a SCPI instrument (or scpi_simulator.py)
+    global acquisition
+
+    if acquisition is not None and acquisition.running:
+        return jsonify({'error': 'Acquisition already running'})
+
+    settings = request.get_json(silent=True) or {}
+    instrument = None
+    try:
+        instrument = ScpiInstrument(settings.get('host', '127.0.0.1'), int(settings.get('port', 5025)))
+        sweep_time = float(settings.get('sweep_time', 1.0))
+        instrument.configure(settings.get('start_frequency'), settings.get('stop_frequency'),
+                             settings.get('sweep_points'), sweep_time)
+        # Reads the instrument settings, the last step that talks to the instrument before the sweeps
+        service = AcquisitionService(instrument, append_sweeps, sweep_time=sweep_time,
+                                     queue_sweeps=app.config['ACQUISITION_QUEUE_SWEEPS'],
+                                     backpressure=app.config['ACQUISITION_BACKPRESSURE'])
+    except (OSError, ValueError) as e:
+        if instrument is not None:
+            instrument.close()
+        return jsonify({'error': 'Failed to connect to the instrument: ' + str(e)})
+
+    # The current live capture is only given up for an instrument that answered,
+    # and before the service appends its first sweep
+    reset_live()
+    service.start()
+    set_live_hdr(service.hdr_content())
+    acquisition = service
+    session['dataset'] = LIVE
+    return jsonify({'success': True, 'hdr_content': service.hdr_content(), 'status': service.status()})
+
+@app.route('/acquisition/stop', methods=['POST'])
+def acquisition_stop():
+    if acquisition is None:
+        return jsonify({'error': 'No acquisition'})
+    acquisition.stop()
+    return jsonify({'success': True, 'status': acquisition.status()})
+
+@app.route('/acquisition/status')
+def acquisition_status():
+    if acquisition is None:
+        return jsonify({'error': 'No acquisition'})
+    return jsonify({'status': acquisition.status(), 'hdr_content': acquisition.hdr_content()})
+
+@app.route('/catalog/scan', methods=['POST'])
+def catalog_scan():
+    counts = get_catalog().scan(catalog_folders(), store_folder=app.config['STORE_FOLDER'])
+    return jsonify({'success': True, 'counts': counts})
+
+@app.route('/catalog/search')
+def catalog_search():
+    # e.g. /catalog/search?frequency=2.4e9&start=2024-01-09&stop=2024-01-10
+    try:
+        captures = get_catalog().search(**{key: request.args[key] for key in
+                                           ['frequency', 'low', 'high', 'start', 'stop', 'instrument', 'limit']
+                                           if key in request.args})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'captures': captures})
+
+@app.route('/dataset_cache/status')
+def dataset_cache_status():
+    return jsonify({'status': datasets.stats(), 'products': products.stats()})
+
+@app.route('/replay/start', methods=['POST'])
+def replay_start():
+    # Replays an uploaded capture through the live ingest path at `speed` x its Sweep time
+    global replay
+
+    settings = request.get_json(silent=True) or {}
+    name = settings.get('dataset')
+    data = get_dataset(name) if name != LIVE else None
+    if data is None:
+        return jsonify({'error': 'Dataset not found'})
+
+    meta = read_meta(app.config['STORE_FOLDER'], name) or {}
+    hdr_content = meta.get('hdr_content')
+    sweep_time = parse_hdr(hdr_content).get('Sweep time') or 1.0
+    try:
+        source = CaptureReplay(data, append_sweeps, sweep_time, speed=float(settings.get('speed', 1)),
+                               loop=bool(settings.get('loop', False)))
+    except ValueError as e:
+        return jsonify({'error': str(e)})
+
+    reset_live()
+    set_live_hdr(hdr_content)
+    source.start()
+    replay = source
+    session['dataset'] = LIVE
+    return jsonify({'success': True, 'hdr_content': hdr_content, 'status': source.status()})
+
+@app.route('/replay/stop', methods=['POST'])
+def replay_stop():
+    if replay is None:
+        return jsonify({'error': 'No replay'})
+    replay.stop()
+    return jsonify({'success': True, 'status': replay.status()})
+
+@app.route('/replay/status')
+def replay_status():
+    if replay is None:
+        return jsonify({'error': 'No replay'})
+    return jsonify({'status': replay.status()})
+
 @app.route('/visualize', methods=['POST'])
 def visualize():
-    global current_dataset, current_y_label
-
-    if current_dataset is None or current_dataset.empty:
-        return jsonify({'error': 'No data available'})
+    name = session_dataset()
+    current_y_label = session.get('y_label', 'Time')
+    if name == LIVE:
+        live = live_snapshot()
+        if live is None:
+            return jsonify({'error': 'No data available'})
+        data = live.data
+        # Sweep index of data[0], past 0 once a rolling live buffer has spilled
+        first_row = live.first_row
+        # Products of live data are only valid for the snapshot they were computed from
+        dataset_key = '{}{}@{}'.format(LIVE, live.feed, live.rows)
+        stored_name = None
+    else:
+        live = None
+        data = get_dataset(name)
+        if data is None or len(data) == 0:
+            return jsonify({'error': 'No data available'})
+        # Store segments of a rolling live capture start past sweep 0
+        first_row = (read_meta(app.config['STORE_FOLDER'], name) or {}).get('first_row', 0)
+        dataset_key = name
+        stored_name = name
 
     try:
-        Start_frequency = None
-        Stop_frequency = None
-        Sweep_points = None
-        Sweep_time = None
-        Start_time = None
         hdr_content = request.json.get('hdrContent', None)
         hdr_found = request.json.get('hdr_found', False)
+        pooling = request.json.get('pooling', 'max')
+        transfer = request.json.get('transfer', 'json')
+        percentiles = tuple(float(q) for q in request.json.get('percentiles', []))
+        # RFI flags overlaid on the waterfall, plus the median without the flagged samples
+        flags = bool(request.json.get('flags', False))
+        flag_threshold = float(request.json.get('flag_threshold', THRESHOLD))
+        viewport_rows = int(request.json.get('viewport_rows', app.config['VIEWPORT_ROWS']))
+        viewport_cols = int(request.json.get('viewport_cols', app.config['VIEWPORT_COLS']))
+        # Time range (ISO timestamps, sweep indices without an HDR) and
+        # frequency range (GHz, channel indices without an HDR) to zoom into
+        zoom = tuple(request.json.get(key) for key in ['t0', 't1', 'f0', 'f1'])
 
         x_label = 'Frequency [GHz]'
         y_label = current_y_label
 
-        if hdr_content:
-            lines = hdr_content.split('\n')
-            for line in lines:
-                if line.startswith("Start frequency:"):
-                    Start_frequency = float(line.split(": ")[1].strip()) / 1e9
-                elif line.startswith("Stop frequency:"):
-                    Stop_frequency = float(line.split(": ")[1].strip()) / 1e9
-                elif line.startswith("Sweep points:"):
-                    Sweep_points = int(line.split(": ")[1].strip())
-                elif line.startswith("Sweep time:"):
-                    Sweep_time = float(line.split(": ")[1].strip())
-                elif line.startswith("Start time:"):
-                    Start_time = line.split(": ")[1].strip()
+        hdr_key = hashlib.sha1((hdr_content or '').encode()).hexdigest()
+        display_key = (hdr_key, current_y_label, pooling, transfer, viewport_rows, viewport_cols,
+                       bool(request.json.get('heatmap', True)), percentiles, flags, flag_threshold, zoom)
+        response = products.get(dataset_key, 'response', display_key)
+        if response is not None:
+            with timed_stage('json_encode'):
+                return jsonify(response)
+
+        with timed_stage('header_parse'):
+            hdr = parse_hdr(hdr_content)
+        Start_frequency = hdr.get('Start frequency')
+        Stop_frequency = hdr.get('Stop frequency')
+        Sweep_points = hdr.get('Sweep points')
+        Sweep_time = hdr.get('Sweep time')
+        Start_time = hdr.get('Start time')
 
         if Start_frequency is None or Stop_frequency is None or Sweep_points is None or Sweep_time is None or Start_time is None:
+            # Without a header the axes are channel and sweep indices
+            n_channels = data.shape[1]
             Start_frequency = 0
-            Stop_frequency = 1
-            Sweep_points = 1
-            Sweep_time = 1
-            Start_time = '00,00,00'
+            Stop_frequency = n_channels - 1
+            Sweep_points = n_channels
             x_label = 'Channel'
             y_label = 'Time Period'
+            common_time_labels = np.arange(first_row, first_row + len(data))
+        else:
+            Start_frequency = Start_frequency / 1e9
+            Stop_frequency = Stop_frequency / 1e9
+            # One timestamp per sweep, Plotly formats only the ticks it shows
+            with timed_stage('time_axis'):
+                common_time_labels = products.get_or_compute(
+                    dataset_key, 'time_axis', hdr_key,
+                    lambda: build_time_axis(len(data), Start_time, Sweep_time, system_date=hdr.get('System date'),
+                                            first_sweep=first_row))
+
+        frequencies = np.linspace(Start_frequency, Stop_frequency, Sweep_points)
+
+        # Rows and columns of the zoom window, by binary search on the axes.
+        # Only that block of the memmap is read from here on.
+        t0, t1, f0, f1 = zoom
+        time_type = float if x_label == 'Channel' else np.datetime64
+        row_start = np.searchsorted(common_time_labels, time_type(t0), 'left') if t0 is not None else 0
+        row_stop = np.searchsorted(common_time_labels, time_type(t1), 'right') if t1 is not None else len(data)
+        col_start = np.searchsorted(frequencies, float(f0), 'left') if f0 is not None else 0
+        col_stop = np.searchsorted(frequencies, float(f1), 'right') if f1 is not None else data.shape[1]
+        if row_start >= row_stop or col_start >= col_stop:
+            return jsonify({'error': 'No sweeps in the selected time and frequency range'})
+        zoomed = (row_start, row_stop, col_start, col_stop) != (0, len(data), 0, data.shape[1])
+        full_data = data
+        full_time_labels = common_time_labels
+        # Products of a zoom window are cached apart from those of the whole dataset
+        window_key = (row_start, row_stop, col_start, col_stop) if zoomed else ()
+        if zoomed:
+            data = data[row_start:row_stop, col_start:col_stop]
+            common_time_labels = common_time_labels[row_start:row_stop]
+            Start_frequency = frequencies[col_start]
+            Stop_frequency = frequencies[col_stop - 1]
+        # The spectra leave out the first two columns of the capture
+        spectrum_start = max(2 - col_start, 0)
+
+        # Only a waterfall level that fits the viewport is sent to the browser
+        with timed_stage('waterfall'):
+            meta = datasets_meta(stored_name)
+            if meta is not None and pooling in meta['pyramid']['modes']:
+                levels = meta['pyramid']['levels']
+                level = pick_level(levels, data.shape, viewport_rows, viewport_cols)
+                time_factor, freq_factor = levels[level]
+                # Cells of the level overlapping the window, so the waterfall
+                # covers whole cells from cell_rows[0] to cell_rows[1]
+                level_rows = (row_start // time_factor, -(-row_stop // time_factor))
+                level_cols = (col_start // freq_factor, -(-col_stop // freq_factor))
+                waterfall = open_level(app.config['STORE_FOLDER'], stored_name, level, pooling)
+                waterfall = waterfall[level_rows[0]:level_rows[1], level_cols[0]:level_cols[1]]
+                cell_rows = (level_rows[0] * time_factor, min(level_rows[1] * time_factor, len(full_data)))
+                cell_cols = (level_cols[0] * freq_factor, min(level_cols[1] * freq_factor, full_data.shape[1]))
+            else:
+                time_factor, freq_factor = fit_factors(data.shape, viewport_rows, viewport_cols)
+                waterfall = decimate(data, time_factor, freq_factor, pooling)
+                cell_rows = (row_start, row_stop)
+                cell_cols = (col_start, col_stop)
+
+        zmin = app.config['WATERFALL_ZMIN']
+        zmax = app.config['WATERFALL_ZMAX']
+        heatmap_graphJSON = None
+        heatmap_compact = None
+        heatmap_raster = None
+        if request.json.get('heatmap', True):
+            heatmap_x = pool(frequencies[np.newaxis, cell_cols[0]:cell_cols[1]], 1, freq_factor, 'mean')[0]
+            heatmap_y = full_time_labels[cell_rows[0]:cell_rows[1]:time_factor]
+
+            heatmap_layout = go.Layout(
+                xaxis=dict(title=x_label),
+                yaxis=dict(title=y_label),
+                width=680,
+                height=600
+            )
+
+            if transfer == 'json':
+                with timed_stage('figure'):
+                    heatmap_trace = go.Heatmap(
+                        z=np.asarray(waterfall),
+                        colorscale='Inferno',
+                        zmin=zmin,
+                        zmax=zmax,
+                        x=heatmap_x,
+                        y=heatmap_y
+                    )
+
+                    heatmap_fig = go.Figure(data=[heatmap_trace], layout=heatmap_layout)
+                with timed_stage('json_encode'):
+                    heatmap_graphJSON = json.dumps(heatmap_fig, cls=plotly.utils.PlotlyJSONEncoder)
+            elif transfer == 'png':
+                # Rendered on the server, the browser only draws the axes around the image
+                with timed_stage('waterfall'):
+                    png = render_png(waterfall, zmin, zmax, latest_on_top=True)
+                heatmap_raster = {
+                    'image': 'data:image/png;base64,' + base64.b64encode(png).decode('ascii'),
+                    'x': encode_axis(heatmap_x),
+                    'y': encode_axis(heatmap_y),
+                    'zmin': zmin,
+                    'zmax': zmax,
+                    'layout': heatmap_layout.to_plotly_json()
+                }
+            else:
+                # The browser rebuilds the trace from the packed matrix and the axes
+                with timed_stage('waterfall'):
+                    z = encode_matrix(waterfall, transfer, zmin, zmax)
+                heatmap_compact = {
+                    'z': z,
+                    'x': encode_axis(heatmap_x),
+                    'y': encode_axis(heatmap_y),
+                    'layout': heatmap_layout.to_plotly_json()
+                }
+        # Otherwise the tiled view fetches the waterfall from /tiles
+
+        # Small datasets get exact spectra, larger ones (and streamed data) the
+        # streaming sketch, within 0.025 dB of the exact values
+        exact = len(data) <= app.config['EXACT_MEDIAN_MAX_ROWS']
+
+        def full_sketch():
+            if live is not None:
+                return live.sketch()
+            return products.get_or_compute(dataset_key, 'sketch', (), lambda: sketch_capture(full_data))
+
+        def spectrum_sketch():
+            if not zoomed:
+                return full_sketch()
+            return products.get_or_compute(dataset_key, 'sketch', window_key, lambda: sketch_capture(data))
+
+        def spectrum_percentile(q):
+            if exact:
+                return np.percentile(data[:, spectrum_start:], q, axis=0)
+            return spectrum_sketch().quantile(q)[spectrum_start:]
+
+        with timed_stage('medians'):
+            data_median = products.get_or_compute(dataset_key, 'frequency_median', window_key,
+                                                  lambda: spectrum_percentile(50))
+            percentile_values = [products.get_or_compute(dataset_key, 'frequency_percentile', (q, window_key),
+                                                         lambda: spectrum_percentile(q))
+                                 for q in percentiles]
+            time_median = products.get_or_compute(dataset_key, 'time_median', window_key,
+                                                  lambda: row_median(data))
+            time_median = pool(time_median[:, np.newaxis], time_factor, 1, pooling)[:, 0]
+
+        flag_overlay = None
+        clean_values = None
+        if flags:
+            with timed_stage('flags'):
+                # The whole dataset is flagged, against the statistics of the
+                # whole dataset, whatever the zoom window
+                params = flag_params(flag_threshold)
+
+                def statistics():
+                    full_exact = len(full_data) <= app.config['EXACT_MEDIAN_MAX_ROWS']
+                    return products.get_or_compute(dataset_key, 'flag_statistics', (), lambda: channel_statistics(
+                        full_data, median=None if full_exact else full_sketch().median(),
+                        exact_max_rows=app.config['EXACT_MEDIAN_MAX_ROWS']))
+
+                if stored_name is not None:
+                    # Flagged once per capture and threshold, kept in the store next to it
+                    mask = open_flags(app.config['STORE_FOLDER'], stored_name, params)
+                    if mask is None:
+                        mask = flag_stored(app.config['STORE_FOLDER'], stored_name, *statistics(),
+                                           threshold=flag_threshold)
+                else:
+                    mask = products.get_or_compute(dataset_key, 'flags', flag_threshold, lambda: flag_capture(
+                        full_data, *statistics(), threshold=flag_threshold))
+                clean_values = products.get_or_compute(
+                    dataset_key, 'clean_median', (flag_threshold, window_key), lambda: clean_median(
+                        data, mask[row_start:row_stop, col_start:col_stop],
+                        exact_max_rows=app.config['EXACT_MEDIAN_MAX_ROWS'])[spectrum_start:])
+                if request.json.get('heatmap', True) and transfer != 'png':
+                    # Fraction of flagged samples in every cell of the waterfall sent
+                    cells = mask[cell_rows[0]:cell_rows[1], cell_cols[0]:cell_cols[1]]
+                    flag_overlay = {
+                        'z': encode_matrix(flag_fraction(cells, time_factor, freq_factor), 'u8', 0, 1),
+                        'x': encode_axis(heatmap_x),
+                        'y': encode_axis(heatmap_y)
+                    }
+
+        with timed_stage('figure'):
+            median_trace = go.Scatter(
+                y=data_median,
+                x=np.linspace(Start_frequency, Stop_frequency, len(data_median)),
+                mode='lines',
+                hoverinfo='x+y',
+                name='Median'
+            )
+            percentile_traces = []
+            for q, values in zip(percentiles, percentile_values):
+                percentile_traces.append(go.Scatter(
+                    y=values,
+                    x=np.linspace(Start_frequency, Stop_frequency, len(values)),
+                    mode='lines',
+                    hoverinfo='x+y',
+                    line=dict(width=1),
+                    name='{:g}th percentile'.format(q)
+                ))
+
+            if clean_values is not None:
+                percentile_traces.append(go.Scatter(
+                    y=clean_values,
+                    x=np.linspace(Start_frequency, Stop_frequency, len(clean_values)),
+                    mode='lines',
+                    hoverinfo='x+y',
+                    name='Median without RFI flags'
+                ))
+
+            median_layout = go.Layout(
+                xaxis_title=x_label,
+                yaxis_title='Median Intensity [dBm]',
+                hovermode='closest',
+                showlegend=bool(percentile_traces),
+                margin=dict(t=2),
+                width=700,
+                height=600
+            )
 
-        hr, min, sec = map(int, Start_time.split(','))
-        start_seconds = hr * 3600 + min * 60 + sec
-
-        time_labels = []
-        for i in range(len(current_dataset)):
-            time_seconds = start_seconds + i * Sweep_time
-            hours = int((time_seconds // 3600) % 24)
-            minutes = int((time_seconds // 60) % 60)
-            seconds = int(time_seconds % 60)
-            new_time = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
-            timestamp = pd.to_datetime(new_time, format='%H:%M:%S').strftime('%H,%M,%S')
-            time_labels.append(timestamp)
-
-        time_labels = sorted(list(set(time_labels)))
-        common_time_labels = time_labels[:len(current_dataset)]
-
-        f_start = Start_frequency
-        f_stop = Stop_frequency
-        f_sweep = Sweep_points
-
-        heatmap_trace = go.Heatmap(
-            z=current_dataset.values,
-            colorscale='Inferno',
-            zmin=-90,
-            zmax=-60,
-            x=np.linspace(f_start, f_stop, f_sweep),
-            y=common_time_labels
-        )
-
-        heatmap_layout = go.Layout(
-            xaxis=dict(title=x_label),
-            yaxis=dict(title=y_label),
-            width=680,
-            height=600
-        )
-
-        heatmap_fig = go.Figure(data=[heatmap_trace], layout=heatmap_layout)
-        heatmap_graphJSON = json.dumps(heatmap_fig, cls=plotly.utils.PlotlyJSONEncoder)
-
-        data_median = np.median(current_dataset.values[:, 2:], axis=0)
-
-        median_trace = go.Scatter(
-            y=data_median,
-            x=np.linspace(Start_frequency, Stop_frequency, len(data_median)),
-            mode='lines',
-            hoverinfo='x+y'
-        )
-
-        median_layout = go.Layout(
-            xaxis_title=x_label,
-            yaxis_title='Median Intensity [dBm]',
-            hovermode='closest',
-            margin=dict(t=2),
-            width=700,
-            height=600
-        )
-
-        median_fig = go.Figure(data=[median_trace], layout=median_layout)
-        median_graphJSON = json.dumps(median_fig, cls=plotly.utils.PlotlyJSONEncoder)
-
-        time_median = np.median(current_dataset.values, axis=1)
-
-        time_median_trace = go.Scatter(
-            x=time_median,
-            y=common_time_labels,
-            mode='lines',
-            name='Median Line'
-        )
-
-        time_median_layout = go.Layout(
-            xaxis_title='Intensity [dBm]',
-            yaxis_title=y_label,
-            hovermode='closest',
-            showlegend=True,
-            width=680,
-            height=600
-        )
-
-        time_median_fig = go.Figure(data=[time_median_trace], layout=time_median_layout)
-        time_median_graphJSON = json.dumps(time_median_fig, cls=plotly.utils.PlotlyJSONEncoder)
-
-        return jsonify({
+            median_fig = go.Figure(data=[median_trace] + percentile_traces, layout=median_layout)
+
+            time_median_trace = go.Scatter(
+                x=time_median,
+                y=common_time_labels[::time_factor],
+                mode='lines',
+                name='Median Line'
+            )
+
+            time_median_layout = go.Layout(
+                xaxis_title='Intensity [dBm]',
+                yaxis_title=y_label,
+                hovermode='closest',
+                showlegend=True,
+                width=680,
+                height=600
+            )
+
+            time_median_fig = go.Figure(data=[time_median_trace], layout=time_median_layout)
+
+        with timed_stage('json_encode'):
+            median_graphJSON = json.dumps(median_fig, cls=plotly.utils.PlotlyJSONEncoder)
+            time_median_graphJSON = json.dumps(time_median_fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+        response = {
             'success': True,
             'heatmap_graphJSON': heatmap_graphJSON,
+            'heatmap_compact': heatmap_compact,
+            'heatmap_raster': heatmap_raster,
             'median_graphJSON': median_graphJSON,
             'time_median_graphJSON': time_median_graphJSON,
             'hdr_content': hdr_content if hdr_content else 'There is no HDR File uploaded.',
-            'y_label': y_label
-        })
+            'y_label': y_label,
+            'dataset': stored_name,
+            'flags': flag_overlay
+        }
+        if live is not None and not zoomed:
+            # Where /live_events should continue the figures from
+            rolling_rows = live.buffer.capacity if isinstance(live.buffer, RollingBuffer) else None
+            response['live'] = {
+                'rows': live.rows,
+                'first_row': first_row,
+                'max_rows': -(-rolling_rows // time_factor) if rolling_rows else None,
+                'time_factor': time_factor,
+                'freq_factor': freq_factor,
+                'pooling': pooling,
+                'y': encode_axis(common_time_labels[::time_factor][:2])
+            }
+        products.put(dataset_key, 'response', display_key, response)
+        with timed_stage('json_encode'):
+            return jsonify(response)
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
+def channel_percentile(name, data, q):
+    # Per-channel percentile of a stored capture, like the spectra of /visualize
+    if len(data) <= app.config['EXACT_MEDIAN_MAX_ROWS']:
+        return products.get_or_compute(name, 'channel_percentile', q, lambda: np.percentile(data, q, axis=0))
+    return products.get_or_compute(name, 'sketch', (), lambda: sketch_capture(data)).quantile(q)
+
+@app.route('/compare', methods=['POST'])
+def compare():
+    # Dataset b minus dataset a, on the frequencies both cover
+    settings = request.get_json(silent=True) or {}
+    names = [settings.get('a'), settings.get('b')]
+    data = [get_dataset(name) if name != LIVE else None for name in names]
+    if any(d is None or len(d) == 0 for d in data):
+        return jsonify({'error': 'Dataset not found'})
+    hdrs = [(read_meta(app.config['STORE_FOLDER'], name) or {}).get('hdr') or {} for name in names]
+    # The spectra leave out the first two columns of a capture
+    frequencies = [frequency_axis(hdr, d.shape[1]) for hdr, d in zip(hdrs, data)]
+    if any(f is None for f in frequencies):
+        return jsonify({'error': 'Both datasets need an HDR with their frequency range'})
+    frequencies = [f[2:] for f in frequencies]
+    grid = common_grid(*frequencies)
+    if grid is None:
+        return jsonify({'error': 'The datasets have no frequencies in common'})
+
+    try:
+        percentiles = [float(q) for q in settings.get('percentiles', [])]
+        spectra = {}
+        for q in [50] + percentiles:
+            a, b = [interpolate_columns(channel_percentile(name, d, q)[2:], f, grid)
+                    for name, d, f in zip(names, data, frequencies)]
+            spectra[q] = (a, b)
+
+        x = grid / 1e9
+        median_fig = go.Figure(data=[
+            go.Scatter(x=x, y=spectra[50][0], mode='lines', name='Median ' + names[0]),
+            go.Scatter(x=x, y=spectra[50][1], mode='lines', name='Median ' + names[1]),
+        ], layout=go.Layout(xaxis_title='Frequency [GHz]', yaxis_title='Median Intensity [dBm]',
+                            hovermode='closest', margin=dict(t=2), width=700, height=600))
+        difference_fig = go.Figure(data=[
+            go.Scatter(x=x, y=b - a, mode='lines', line=dict(width=1 if q != 50 else 2),
+                       name='Median' if q == 50 else '{:g}th percentile'.format(q))
+            for q, (a, b) in spectra.items()
+        ], layout=go.Layout(xaxis_title='Frequency [GHz]',
+                            yaxis_title='{} - {} [dB]'.format(names[1], names[0]),
+                            hovermode='closest', margin=dict(t=2), width=700, height=600))
+        response = {
+            'success': True,
+            'frequency': encode_axis(x),
+            'median_difference': np.round(spectra[50][1] - spectra[50][0], 3).tolist(),
+            'median_graphJSON': json.dumps(median_fig, cls=plotly.utils.PlotlyJSONEncoder),
+            'difference_graphJSON': json.dumps(difference_fig, cls=plotly.utils.PlotlyJSONEncoder)
+        }
+
+        if settings.get('waterfall', False):
+            seconds = [sweep_seconds(hdr, len(d)) for hdr, d in zip(hdrs, data)]
+            if any(s is None for s in seconds):
+                return jsonify({'error': 'Both datasets need an HDR with their start and sweep time'})
+            full_frequencies = [frequency_axis(hdr, d.shape[1]) for hdr, d in zip(hdrs, data)]
+            n_bins = int(settings.get('viewport_rows', app.config['VIEWPORT_ROWS']))
+            # Wall-clock alignment when the captures overlap, otherwise from their starts
+            aligns = [settings['align']] if settings.get('align') in ('absolute', 'start') else ['absolute', 'start']
+            for align in aligns:
+                result = difference_waterfall(data[0], seconds[0], full_frequencies[0],
+                                              data[1], seconds[1], full_frequencies[1], grid, n_bins, align)
+                if result is not None:
+                    break
+            if result is None:
+                return jsonify({'error': 'The datasets were not recorded at the same time'})
+            difference, starts = result
+            zrange = app.config['COMPARE_ZRANGE']
+            # Bin start times, or seconds from the start of both captures
+            y = np.datetime64(0, 'us') + (starts * 1e6).astype('timedelta64[us]') if align == 'absolute' else starts
+            response['waterfall'] = {
+                'z': encode_matrix(difference, settings.get('transfer', 'f32'), -zrange, zrange),
+                'x': encode_axis(x),
+                'y': encode_axis(y),
+                'align': align
+            }
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/live_events')
+def live_events():
+    # Server-Sent Events carrying only the sweeps appended after `since`, pooled
+    # like the figures the client already shows, plus the updated medians
+    with live_lock.read():
+        buffer = live_buffer
+    if buffer is None or len(buffer) == 0:
+        return jsonify({'error': 'No live data'})
+
+    time_factor = max(int(request.args.get('time_factor', 1)), 1)
+    freq_factor = max(int(request.args.get('freq_factor', 1)), 1)
+    pooling = request.args.get('pooling', 'max')
+    # Pooled rows of the figures start at sweep `first`. Sweeps of a partial
+    # last row are already shown, continue at the next full row
+    first = int(request.args.get('first', 0))
+    cursor = first + -(-(int(request.args.get('since', 0)) - first) // time_factor) * time_factor
+    zmin = app.config['WATERFALL_ZMIN']
+    zmax = app.config['WATERFALL_ZMAX']
+
+    def events():
+        nonlocal cursor
+        while True:
+            with live_updated:
+                live_updated.wait_for(lambda: live_buffer is not buffer or len(buffer) - cursor >= time_factor,
+                                      timeout=15)
+            with live_lock.read():
+                if live_buffer is not buffer:
+                    yield 'event: reset\ndata: {}\n\n'
+                    return
+                if cursor < buffer.first_row:
+                    # A slow client skips the sweeps that rolled out of memory
+                    cursor += -(-(buffer.first_row - cursor) // time_factor) * time_factor
+                rows = len(buffer)
+                n_rows = (rows - cursor) // time_factor
+                sweeps = buffer.rows(cursor, cursor + n_rows * time_factor) if n_rows else None
+                frequency_median = live_sketch.median()[2:] if n_rows else None
+            if n_rows == 0:
+                yield ': keepalive\n\n'
+                continue
+
+            update = {
+                'start': (cursor - first) // time_factor,
+                'rows': rows,
+                'z': encode_matrix(pool(sweeps, time_factor, freq_factor, pooling), 'u8', zmin, zmax),
+                'time_median': pool(row_median(sweeps)[:, np.newaxis], time_factor, 1, pooling)[:, 0].tolist(),
+                'frequency_median': np.round(frequency_median, 3).tolist()
+            }
+            cursor += n_rows * time_factor
+            yield 'event: sweeps\ndata: ' + json.dumps(update) + '\n\n'
+            # Sweeps arriving meanwhile are sent together in the next update
+            time.sleep(app.config['LIVE_EVENT_INTERVAL'])
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/tiles/<dataset>/info')
+def tiles_info(dataset):
+    meta = read_meta(app.config['STORE_FOLDER'], dataset) if is_store_name(dataset) else None
+    if meta is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+    return jsonify(tile_info(meta))
+
+@app.route('/tiles/<dataset>/<int:level>/<int:t>/<int:f>')
+def tiles(dataset, level, t, f):
+    meta = read_meta(app.config['STORE_FOLDER'], dataset) if is_store_name(dataset) else None
+    if meta is None:
+        return jsonify({'error': 'Dataset not found'}), 404
+
+    pooling = request.args.get('pooling', 'max')
+    encoding = request.args.get('format', 'f32')
+    if encoding not in ENCODINGS:
+        return jsonify({'error': 'Unknown tile format: ' + encoding}), 400
+    etag = tile_etag(meta, level, t, f, pooling, encoding)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        tile = read_tile(app.config['STORE_FOLDER'], dataset, meta, level, t, f, pooling)
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Raw row-major samples, the shape and the quantization range travel in headers
+    zmin = app.config['WATERFALL_ZMIN']
+    zmax = app.config['WATERFALL_ZMAX']
+    response = make_response(tile_bytes(tile, encoding, zmin, zmax))
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.headers['X-Tile-Shape'] = '{},{}'.format(*tile.shape)
+    response.headers['X-Tile-Format'] = encoding
+    response.headers['X-Tile-Range'] = '{},{}'.format(zmin, zmax)
+    response.headers['Cache-Control'] = 'no-cache'  # Revalidate with the ETag
+    response.set_etag(etag)
+    return response
+
 @app.route('/update_y_label', methods=['POST'])
 def update_y_label():
-    global current_y_label
-
     new_y_label = request.json.get('y_label')
 
     if new_y_label:
-        current_y_label = new_y_label
-        return jsonify({'success': 'Y-axis label updated successfully', 'y_label': current_y_label})
+        # Only changes the figures of this session
+        session['y_label'] = new_y_label
+        return jsonify({'success': 'Y-axis label updated successfully', 'y_label': new_y_label})
     else:
         return jsonify({'error': 'Failed to update Y-axis label'})
 
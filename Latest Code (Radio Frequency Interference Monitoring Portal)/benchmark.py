@@ -0,0 +1,168 @@
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+import app as portal
+from synth_capture import write_capture
+
+SIZES = (1000, 100000, 1000000)  # Sweeps per synthetic capture
+SWEEP_POINTS = 1001
+STREAMED_SWEEPS = 200  # /stream_data requests per capture
+BENCHMARK_FOLDER = 'Benchmark'  # Synthetic captures (kept between runs) and the upload/store folders
+
+
+class RssSampler:
+    """Peak resident set size of this process over a `with` block, sampled every `interval` seconds."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            # Lifetime peak where /proc is not available
+            scale = 1 if sys.platform == 'darwin' else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def code_version():
+    """Commit of the portal code, with '-dirty' for uncommitted changes, or None outside git."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=here,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(client, stage, request):
+    """Runs request(client) (one or more requests) and measures it. Returns the result record."""
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        responses = request(client)
+        seconds = time.perf_counter() - start
+    responses = responses if isinstance(responses, list) else [responses]
+    errors = [r.get_json().get('error') for r in responses if r.is_json and r.get_json() and 'error' in r.get_json()]
+    return {
+        'stage': stage,
+        'seconds': round(seconds, 6),
+        'requests': len(responses),
+        'peak_rss_mb': round(rss.peak / 2**20, 1),
+        'response_bytes': sum(len(r.get_data()) for r in responses),
+        'error': errors[0] if errors else None,
+    }
+
+
+def benchmark_capture(n_sweeps, folder=BENCHMARK_FOLDER):
+    """Benchmarks the portal endpoints on a synthetic capture of n_sweeps x SWEEP_POINTS."""
+    captures = os.path.join(folder, 'captures')
+    upload = os.path.join(folder, 'Dataset')
+    store = os.path.join(folder, 'Store')
+    for path in [captures, upload]:
+        if not os.path.exists(path):
+            os.makedirs(path)
+    # Conversion and pyramid are part of the upload, start without a store copy
+    shutil.rmtree(store, ignore_errors=True)
+
+    name = 'synthetic_{}'.format(n_sweeps)
+    csv_path = os.path.join(captures, name + '.csv')
+    if not os.path.isfile(csv_path):
+        write_capture(csv_path, n_sweeps, SWEEP_POINTS, started=time.localtime(0))
+    shutil.copy(os.path.join(captures, name + '_hdr'), os.path.join(upload, name + '_hdr'))
+    hdr_content = open(os.path.join(captures, name + '_hdr')).read()
+
+    portal.app.config['UPLOAD_FOLDER'] = upload
+    portal.app.config['STORE_FOLDER'] = store
+    # Neither the catalog in the working directory nor ~/Downloads are touched
+    portal.app.config['CATALOG_PATH'] = os.path.join(folder, 'catalog.sqlite')
+    portal.app.config['HDR_FOLDERS'] = [captures]
+    # Every size streams into a live capture of its own
+    portal.reset_live()
+    client = portal.app.test_client()
+    sweep = {str(i): v for i, v in enumerate(np.full(SWEEP_POINTS, -85.0).tolist())}
+
+    def upload_dataset(c):
+        with open(csv_path, 'rb') as f:
+            return c.post('/upload_dataset', data={'file': (f, name + '.csv')})
+
+    def visualize(transfer, **extra):
+        return lambda c: c.post('/visualize', json=dict({'hdrContent': hdr_content, 'transfer': transfer}, **extra))
+
+    stages = [
+        ('upload_dataset', upload_dataset),
+        ('visualize_json', visualize('json')),
+        ('visualize_json_cached', visualize('json')),
+        ('visualize_u8', visualize('u8')),
+        ('visualize_png', visualize('png')),
+        ('visualize_percentiles', visualize('u8', percentiles=[10, 90])),
+        ('stream_data', lambda c: [c.post('/stream_data', json=sweep) for _ in range(STREAMED_SWEEPS)]),
+        ('visualize_live', visualize('u8')),
+        ('remove_dataset', lambda c: c.post('/remove_dataset', data={'filename': name + '.csv'})),
+    ]
+    results = []
+    for stage, request in stages:
+        record = run_stage(client, stage, request)
+        record.update({'sweeps': n_sweeps, 'sweep_points': SWEEP_POINTS,
+                       'csv_bytes': os.path.getsize(csv_path)})
+        results.append(record)
+        print('{:>9} sweeps  {:<22} {:9.3f} s  {:8.1f} MB RSS  {:12d} bytes{}'.format(
+            n_sweeps, stage, record['seconds'], record['peak_rss_mb'], record['response_bytes'],
+            '  ERROR: ' + record['error'] if record['error'] else ''))
+    return results
+
+
+def run(sizes=SIZES, output='benchmark_results.jsonl'):
+    """
+    Benchmarks every capture size and appends the records to `output`, one
+    JSON object per line, tagged with the code version, so the results of
+    successive versions can be compared.
+    """
+    run_info = {
+        'run': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version': code_version(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+    with open(output, 'a') as f:
+        for n_sweeps in sizes:
+            for record in benchmark_capture(n_sweeps):
+                f.write(json.dumps(dict(run_info, **record)) + '\n')
+                f.flush()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print("Usage: python benchmark.py [results.jsonl] [sweeps ...]")
+        sys.exit(0)
+    output = sys.argv[1] if len(sys.argv) > 1 else 'benchmark_results.jsonl'
+    sizes = [int(n) for n in sys.argv[2:]] or SIZES
+    run(sizes, output)
@@ -0,0 +1,301 @@
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Numeric HDR fields and the type they are parsed into
+HDR_NUMERIC_FIELDS = {
+    'Start frequency': float,
+    'Stop frequency': float,
+    'Center frequency': float,
+    'Frequency span': float,
+    'Resolution BW': float,
+    'Video BW': float,
+    'Sweep points': int,
+    'Sweep time': float,
+}
+
+
+# HDR files of a capture NAME.csv, in order of preference
+HDR_SUFFIXES = ('_hdr', '_hdr.txt', '.txt')
+
+
+def find_hdr(csv_path):
+    """HDR file next to a capture CSV (NAME_hdr, NAME_hdr.txt or NAME.txt), or None."""
+    base = os.path.splitext(csv_path)[0]
+    for suffix in HDR_SUFFIXES:
+        if os.path.isfile(base + suffix):
+            return base + suffix
+    return None
+
+
+def parse_hdr(hdr_content):
+    """
+    Parses the text of an HDR file into a dictionary.
+
+    Every "Key: value" line becomes an entry. Values of the fields listed in
+    HDR_NUMERIC_FIELDS are converted to numbers, everything else is kept as a
+    stripped string (e.g. 'Start time' -> '12,30,21').
+    """
+    hdr = {}
+    if not hdr_content:
+        return hdr
+    for line in hdr_content.split('\n'):
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.strip()
+        value = value.strip()
+        if key in HDR_NUMERIC_FIELDS:
+            try:
+                value = HDR_NUMERIC_FIELDS[key](float(value))
+            except ValueError:
+                continue
+        hdr[key] = value
+    return hdr
+
+
+def store_paths(store_folder, name):
+    """Returns the (data, sidecar) paths of capture `name` in the store."""
+    base = os.path.join(store_folder, name)
+    return base + '.dat', base + '.json'
+
+
+def data_path(store_folder, name, meta=None):
+    """Path of the data of a stored capture: the file its sidecar names, else `<name>.dat`."""
+    if meta and meta.get('data_file'):
+        return os.path.join(store_folder, meta['data_file'])
+    return store_paths(store_folder, name)[0]
+
+
+def read_meta(store_folder, name):
+    """Returns the sidecar metadata of a stored capture, or None if it is not stored."""
+    _, meta_path = store_paths(store_folder, name)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def store_version(store_folder, name):
+    """
+    Token of the stored copy of a capture, None if it is not stored.
+
+    Every conversion, HDR update or removal replaces the sidecar, so the
+    token changes with it. Processes that did not make the change compare
+    tokens to notice it.
+    """
+    _, meta_path = store_paths(store_folder, name)
+    try:
+        stat = os.stat(meta_path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def is_current(meta, csv_path):
+    """True if the stored capture was converted from the current version of `csv_path`."""
+    if meta is None:
+        return False
+    try:
+        stat = os.stat(csv_path)
+    except OSError:
+        return False
+    return meta.get('source_size') == stat.st_size and meta.get('source_mtime') == stat.st_mtime
+
+
+def write_meta(store_folder, name, meta):
+    """Writes the sidecar atomically so readers never see a half written file."""
+    _, meta_path = store_paths(store_folder, name)
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, meta_path)
+
+
+def publish(store_folder, name, tmp_path, meta):
+    """
+    Swaps a completely written data file and its sidecar into the store.
+
+    The data is moved to a new `<name>.<version>.dat` that no sidecar names
+    yet, then the sidecar is replaced atomically and names it, so readers
+    always find a sidecar and the data it describes. The previous data file
+    is deleted last, readers that have mapped it keep their mapping.
+    """
+    old_path = data_path(store_folder, name, read_meta(store_folder, name))
+    new_path = store_paths(store_folder, '{}.{}'.format(name, uuid.uuid4().hex[:12]))[0]
+    os.replace(tmp_path, new_path)
+    meta['data_file'] = os.path.basename(new_path)
+    write_meta(store_folder, name, meta)
+    if old_path != new_path and os.path.isfile(old_path):
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass  # Still mapped on Windows, the next publish or remove_capture retries
+
+
+def discard(tmp_path):
+    """Deletes a partly written data file, e.g. after a failed conversion."""
+    if os.path.isfile(tmp_path):
+        os.remove(tmp_path)
+
+
+def sniff_csv(csv_path):
+    """
+    Looks at the first line of a capture CSV.
+
+    Returns (n_values, has_header): the number of comma separated values on
+    the line and whether the line is a text header rather than the first sweep.
+    A trailing comma ends the line without adding a value.
+    """
+    with open(csv_path, 'r') as f:
+        first_line = f.readline().strip()
+    fields = first_line.split(',') if first_line else []
+    if len(fields) > 1 and fields[-1].strip() == '':
+        fields = fields[:-1]
+    try:
+        [float(field) for field in fields]
+        has_header = False
+    except ValueError:
+        has_header = True
+    return len(fields), has_header
+
+
+def sweep_values(chunk, n_cols, csv_path):
+    """
+    Values of a chunk of sweeps parsed by pd.read_csv, checked to have
+    `n_cols` values per sweep. The empty field after a trailing comma is dropped.
+    """
+    values = chunk.to_numpy()
+    if values.shape[1] == n_cols + 1 and np.isnan(values[:, -1]).all():
+        values = values[:, :n_cols]
+    if values.shape[1] != n_cols:
+        raise ValueError('Expected {} values per sweep in {}, found {}'.format(n_cols, csv_path, values.shape[1]))
+    return values
+
+
+def estimate_rows(csv_path, sample_bytes=1 << 20):
+    """Estimates the number of sweeps in a CSV from its size and the length of the first lines."""
+    file_size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    n_lines = max(sample.count(b'\n'), 1)
+    bytes_per_row = len(sample) / n_lines
+    # A little headroom so that the buffer rarely has to grow
+    return int(file_size / bytes_per_row * 1.05) + 1
+
+
+def convert_csv(csv_path, store_folder, name, hdr_content=None, dtype='float32', chunksize=100000):
+    """
+    Converts a capture CSV (rows are sweeps) into the binary store.
+
+    The number of columns comes from the HDR "Sweep points" (or the first line
+    when there is no HDR) and the number of rows is estimated from the file
+    size, so the CSV is parsed in a single pass straight into a preallocated
+    memory-mapped file. If the estimate is too small the file grows
+    geometrically; at the end it is trimmed to the rows actually read and
+    swapped into the store with `publish`. The shape, dtype and HDR content
+    go to the `<name>.json` sidecar. Returns the sidecar metadata.
+    """
+    if not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+
+    hdr = parse_hdr(hdr_content)
+    n_values, has_header = sniff_csv(csv_path)
+    n_cols = hdr.get('Sweep points', n_values)
+    if n_cols != n_values:
+        raise ValueError('HDR gives {} sweep points but {} has {} values per sweep'.format(n_cols, csv_path, n_values))
+
+    dtype = np.dtype(dtype)
+    row_bytes = max(n_cols, 1) * dtype.itemsize
+    capacity = estimate_rows(csv_path)
+    n_rows = 0
+
+    tmp_path = store_paths(store_folder, name)[0] + '.tmp'
+    try:
+        with open(tmp_path, 'w+b') as out:
+            out.truncate(capacity * row_bytes)
+            buffer = np.memmap(out, dtype=dtype, mode='r+', shape=(capacity, n_cols))
+            # pandas cannot parse into float16 directly, so it always parses float32 chunks
+            reader = pd.read_csv(csv_path, header=None, skiprows=1 if has_header else 0,
+                                 dtype=np.float32, chunksize=chunksize)
+            for chunk in reader:
+                values = sweep_values(chunk, n_cols, csv_path)
+                if n_rows + len(values) > capacity:
+                    buffer.flush()
+                    del buffer
+                    capacity = max(capacity * 2, n_rows + len(values))
+                    out.truncate(capacity * row_bytes)
+                    buffer = np.memmap(out, dtype=dtype, mode='r+', shape=(capacity, n_cols))
+                buffer[n_rows:n_rows + len(values)] = values
+                n_rows += len(values)
+            buffer.flush()
+            del buffer
+            out.truncate(n_rows * row_bytes)
+
+        stat = os.stat(csv_path)
+        meta = {
+            'name': name,
+            'dtype': dtype.str,
+            'shape': [n_rows, n_cols],
+            'source': os.path.abspath(csv_path),
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'hdr_content': hdr_content,
+            'hdr': hdr,
+        }
+        publish(store_folder, name, tmp_path, meta)
+    except BaseException:
+        # A failed upload must not leave a file as large as the capture behind
+        discard(tmp_path)
+        raise
+    return meta
+
+
+def open_capture(store_folder, name):
+    """
+    Opens a stored capture read-only with np.memmap.
+
+    Returns (data, meta). Only the pages that are actually touched are read
+    from disk, so reopening a capture costs a sidecar read and an mmap call.
+    """
+    for attempt in range(3):
+        meta = read_meta(store_folder, name)
+        if meta is None:
+            raise FileNotFoundError('Capture not in store: ' + name)
+        shape = tuple(meta['shape'])
+        if shape[0] == 0:
+            # np.memmap cannot map an empty file
+            return np.empty(shape, dtype=meta['dtype']), meta
+        try:
+            return np.memmap(data_path(store_folder, name, meta), dtype=meta['dtype'], mode='r', shape=shape), meta
+        except FileNotFoundError:
+            # Published again between reading the sidecar and mapping its data
+            if attempt == 2:
+                raise
+
+
+def load_capture(csv_path, store_folder, name, hdr_content=None, dtype='float32'):
+    """
+    Returns (data, meta) for a capture CSV, converting it only if the store
+    has no up to date copy. A newer HDR is written into the existing sidecar.
+    """
+    meta = read_meta(store_folder, name)
+    if not is_current(meta, csv_path) or np.dtype(meta['dtype']) != np.dtype(dtype):
+        convert_csv(csv_path, store_folder, name, hdr_content=hdr_content, dtype=dtype)
+    elif hdr_content is not None and meta.get('hdr_content') != hdr_content:
+        meta['hdr_content'] = hdr_content
+        meta['hdr'] = parse_hdr(hdr_content)
+        write_meta(store_folder, name, meta)
+    return open_capture(store_folder, name)
+
+
+def remove_capture(store_folder, name):
+    """Deletes a capture and its sidecar from the store, the sidecar first so readers never find it without data."""
+    data_file, meta_path = store_paths(store_folder, name)
+    paths = [meta_path, data_path(store_folder, name, read_meta(store_folder, name)), data_file]
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
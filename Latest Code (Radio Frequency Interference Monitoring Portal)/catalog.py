@@ -0,0 +1,262 @@
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+import numpy as np
+
+from capture_store import HDR_SUFFIXES, data_path, find_hdr, is_current, parse_hdr, read_meta, sniff_csv
+from time_axis import start_datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    path TEXT PRIMARY KEY,  -- absolute path of the CSV
+    name TEXT NOT NULL,
+    csv_size INTEGER,
+    csv_mtime REAL,
+    hdr_path TEXT,
+    hdr_mtime REAL,
+    instrument TEXT,
+    start_time TEXT,  -- ISO 8601, NULL without an HDR "System date"
+    stop_time TEXT,
+    start_frequency REAL,  -- Hz
+    stop_frequency REAL,
+    sweep_points INTEGER,
+    sweep_time REAL,  -- seconds
+    rows INTEGER,
+    store_path TEXT  -- binary copy in the capture store, NULL if not converted
+);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (start_time, stop_time);
+CREATE INDEX IF NOT EXISTS captures_frequency ON captures (start_frequency, stop_frequency);
+CREATE INDEX IF NOT EXISTS captures_name ON captures (name);
+CREATE TABLE IF NOT EXISTS hdr_files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,  -- capture name the HDR belongs to
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS hdr_files_name ON hdr_files (name);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER  -- mtime of the folder when it was last scanned
+);
+"""
+
+def hdr_capture_name(filename):
+    """Capture name of an HDR file name (NAME_hdr, NAME_hdr.txt or NAME.txt), or None."""
+    for suffix in HDR_SUFFIXES:
+        if filename.endswith(suffix) and len(filename) > len(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def count_rows(csv_path, has_header, block_bytes=1 << 24):
+    """Number of sweeps in a CSV, counting newlines a block at a time."""
+    rows = 0
+    last = b'\n'
+    with open(csv_path, 'rb') as f:
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            rows += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        rows += 1  # No newline after the last sweep
+    return max(rows - (1 if has_header else 0), 0)
+
+
+def iso(timestamp):
+    return str(np.datetime64(timestamp, 's'))
+
+
+class Catalog:
+    """
+    SQLite index of the captures on disk and their HDR files.
+
+    `scan` records every CSV of some folders with its HDR fields, absolute
+    start and stop time, row count and binary store copy. Files whose size
+    and mtime did not change since the last scan are skipped, so rescans are
+    cheap. Every call opens its own connection, so a Catalog can be shared by
+    threads and by processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as db, db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def scan(self, folders, store_folder=None):
+        """
+        Indexes the CSV and HDR files directly in `folders`.
+
+        Returns the counts of captures indexed, unchanged and removed (files
+        of these folders that no longer exist).
+        """
+        csv_paths, removed = self._scan_folders(folders)
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': removed}
+        # HDR files of all folders are known before the captures are paired with them
+        for csv_path in csv_paths:
+            if self.add(csv_path, store_folder=store_folder):
+                counts['indexed'] += 1
+            else:
+                counts['unchanged'] += 1
+        return counts
+
+    def scan_hdr(self, folders):
+        """
+        Indexes the HDR files directly in `folders`, skipping the folders
+        whose mtime shows no file was added, removed or renamed since their
+        last scan. A folder that did not change costs one stat.
+        """
+        with closing(self._connect()) as db:
+            scanned = dict(db.execute('SELECT path, mtime_ns FROM folders').fetchall())
+        changed = []
+        for folder in folders:
+            try:
+                mtime_ns = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            if scanned.get(os.path.abspath(folder)) != mtime_ns:
+                changed.append(folder)
+        if changed:
+            self._scan_folders(changed)
+
+    def _scan_folders(self, folders):
+        # Records the HDR files and drops the records of deleted files.
+        # Returns the CSV paths found and the number of captures dropped.
+        csv_paths = []
+        removed = 0
+        with closing(self._connect()) as db, db:
+            for folder in folders:
+                if not os.path.isdir(folder):
+                    continue
+                folder = os.path.abspath(folder)
+                # Taken before the listing, so files added meanwhile change it again
+                db.execute('INSERT OR REPLACE INTO folders (path, mtime_ns) VALUES (?, ?)',
+                           (folder, os.stat(folder).st_mtime_ns))
+                present = set()
+                for entry in os.scandir(folder):
+                    if not entry.is_file():
+                        continue
+                    present.add(entry.path)
+                    name = hdr_capture_name(entry.name)
+                    if name is not None:
+                        db.execute('INSERT OR REPLACE INTO hdr_files (path, name, mtime) VALUES (?, ?, ?)',
+                                   (entry.path, name, entry.stat().st_mtime))
+                    elif entry.name.endswith('.csv'):
+                        csv_paths.append(entry.path)
+                for table in ['captures', 'hdr_files']:
+                    stale = [row['path'] for row in db.execute(
+                        'SELECT path FROM {} WHERE path LIKE ?'.format(table), (os.path.join(folder, '%'),))
+                        if os.path.dirname(row['path']) == folder and row['path'] not in present]
+                    db.executemany('DELETE FROM {} WHERE path = ?'.format(table), [(path,) for path in stale])
+                    if table == 'captures':
+                        removed += len(stale)
+        return csv_paths, removed
+
+    def find_hdr(self, name, folder=None):
+        """Path of the HDR file of capture `name`, the one in `folder` or else the newest, or None."""
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT path FROM hdr_files WHERE name = ? ORDER BY mtime DESC', (name,)).fetchall()
+        paths = [row['path'] for row in rows if os.path.isfile(row['path'])]
+        for path in paths:
+            if folder is not None and os.path.dirname(path) == os.path.abspath(folder):
+                return path
+        return paths[0] if paths else None
+
+    def add(self, csv_path, hdr_path=None, store_folder=None, store_name=None):
+        """
+        Indexes one capture CSV unless it is indexed already with the same
+        size, mtime and HDR. Returns True if the record was (re)written.
+
+        The HDR defaults to the one next to the CSV (see capture_store.find_hdr),
+        then to the newest HDR of that name anywhere in the catalog. The row
+        count comes from the store sidecar when `store_folder` has an up to
+        date copy (stored under `store_name`, by default the CSV file name),
+        otherwise the CSV lines are counted.
+        """
+        csv_path = os.path.abspath(csv_path)
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        stat = os.stat(csv_path)
+        if hdr_path is None:
+            hdr_path = find_hdr(csv_path) or self.find_hdr(name)
+        hdr_path = os.path.abspath(hdr_path) if hdr_path is not None else None
+        hdr_mtime = os.stat(hdr_path).st_mtime if hdr_path is not None else None
+        store_name = store_name or os.path.basename(csv_path)
+        meta = read_meta(store_folder, store_name) if store_folder is not None else None
+        store_path = os.path.abspath(data_path(store_folder, store_name, meta)) if is_current(meta, csv_path) else None
+
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT csv_size, csv_mtime, hdr_path, hdr_mtime, store_path FROM captures WHERE path = ?',
+                             (csv_path,)).fetchone()
+            if row is not None and tuple(row) == (stat.st_size, stat.st_mtime, hdr_path, hdr_mtime, store_path):
+                return False
+
+            hdr = {}
+            if hdr_path is not None:
+                with open(hdr_path, 'r') as f:
+                    hdr = parse_hdr(f.read())
+            n_values, has_header = sniff_csv(csv_path)
+            rows = meta['shape'][0] if store_path is not None else count_rows(csv_path, has_header)
+            start_time = stop_time = None
+            if hdr.get('System date') and hdr.get('Start time'):
+                start = start_datetime(hdr['Start time'], hdr['System date'])
+                start_time = iso(start)
+                if hdr.get('Sweep time') is not None:
+                    stop_time = iso(start + np.timedelta64(int(round(rows * hdr['Sweep time'] * 1e6)), 'us'))
+            db.execute('INSERT OR REPLACE INTO captures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                csv_path, name, stat.st_size, stat.st_mtime, hdr_path, hdr_mtime, hdr.get('Instrument ID'),
+                start_time, stop_time, hdr.get('Start frequency'), hdr.get('Stop frequency'),
+                hdr.get('Sweep points', n_values), hdr.get('Sweep time'), rows, store_path))
+        return True
+
+    def forget_store(self, store_path):
+        """Marks the captures converted to `store_path` as not converted, e.g. after remove_dataset."""
+        with closing(self._connect()) as db, db:
+            db.execute('UPDATE captures SET store_path = NULL WHERE store_path = ?', (os.path.abspath(store_path),))
+
+    def search(self, frequency=None, low=None, high=None, start=None, stop=None, instrument=None, limit=1000):
+        """
+        Captures covering `frequency` (Hz) or overlapping low..high, recorded
+        (partly) between `start` and `stop` (anything np.datetime64 parses),
+        newest first. Returns a list of dicts.
+        """
+        conditions = []
+        args = []
+        if frequency is not None:
+            conditions.append('start_frequency <= ? AND stop_frequency >= ?')
+            args += [float(frequency), float(frequency)]
+        if high is not None:
+            conditions.append('start_frequency <= ?')
+            args.append(float(high))
+        if low is not None:
+            conditions.append('stop_frequency >= ?')
+            args.append(float(low))
+        if stop is not None:
+            conditions.append('start_time <= ?')
+            args.append(iso(stop))
+        if start is not None:
+            conditions.append('stop_time >= ?')
+            args.append(iso(start))
+        if instrument is not None:
+            conditions.append('instrument LIKE ?')
+            args.append('%' + instrument + '%')
+        query = 'SELECT * FROM captures'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start_time DESC LIMIT ?'
+        with closing(self._connect()) as db:
+            return [dict(row) for row in db.execute(query, args + [int(limit)])]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python catalog.py <catalog.sqlite> <folder> [folder ...]")
+        sys.exit(1)
+    counts = Catalog(sys.argv[1]).scan(sys.argv[2:])
+    print('{indexed} captures indexed, {unchanged} unchanged, {removed} removed'.format(**counts))
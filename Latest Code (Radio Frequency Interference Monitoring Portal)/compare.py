@@ -0,0 +1,102 @@
+import numpy as np
+
+from time_axis import build_time_axis
+
+
+def frequency_axis(hdr, n_channels):
+    """Frequency of every channel in Hz from the HDR, or None without a frequency range."""
+    if hdr.get('Start frequency') is None or hdr.get('Stop frequency') is None:
+        return None
+    return np.linspace(hdr['Start frequency'], hdr['Stop frequency'], n_channels)
+
+
+def common_grid(frequencies_a, frequencies_b):
+    """
+    Frequency grid over the overlap of two frequency axes, None if they do not overlap.
+
+    The grid has the step of the coarser axis, so neither capture is
+    compared at a resolution it does not have.
+    """
+    low = max(frequencies_a[0], frequencies_b[0])
+    high = min(frequencies_a[-1], frequencies_b[-1])
+    if low > high:
+        return None
+    step = max(np.diff(frequencies_a).mean() if len(frequencies_a) > 1 else 0,
+               np.diff(frequencies_b).mean() if len(frequencies_b) > 1 else 0)
+    n = int(np.floor((high - low) / step + 1e-9)) + 1 if step > 0 else 1
+    return low + step * np.arange(n)
+
+
+def interpolate_columns(values, frequencies, grid):
+    """
+    Linear interpolation of the channels of `values` (1D spectrum or 2D
+    sweeps x channels) from `frequencies` (at least two) onto `grid`.
+
+    The two neighbouring channels and the weights are found once for the
+    whole grid, then every row is interpolated with one vectorized
+    expression. NaN stays NaN.
+    """
+    upper = np.clip(np.searchsorted(frequencies, grid), 1, len(frequencies) - 1)
+    lower = upper - 1
+    weight = (grid - frequencies[lower]) / (frequencies[upper] - frequencies[lower])
+    values = np.asarray(values, dtype=np.float64)
+    return values[..., lower] * (1 - weight) + values[..., upper] * weight
+
+
+def sweep_seconds(hdr, n_sweeps):
+    """
+    Start of every sweep in seconds: since the epoch with a full HDR
+    (since midnight without "System date"), None without a start or sweep time.
+    """
+    if hdr.get('Start time') is None or hdr.get('Sweep time') is None:
+        return None
+    times = build_time_axis(n_sweeps, hdr['Start time'], hdr['Sweep time'], system_date=hdr.get('System date'))
+    return (times - np.datetime64(0, 'us')) / np.timedelta64(1, 's')
+
+
+def binned_sweeps(data, seconds, edges, block_rows=16384):
+    """
+    Mean sweep of every time bin [edges[i], edges[i + 1]), NaN for empty bins.
+
+    `seconds` (increasing) gives the time of every row of `data`. Only the
+    rows inside the bins are read, `block_rows` at a time.
+    """
+    n_bins = len(edges) - 1
+    sums = np.zeros((n_bins, data.shape[1]), dtype=np.float64)
+    counts = np.zeros(n_bins, dtype=np.int64)
+    first, last = np.searchsorted(seconds, [edges[0], edges[-1]])
+    for start in range(first, last, block_rows):
+        stop = min(start + block_rows, last)
+        bins = np.clip(np.searchsorted(edges, seconds[start:stop], 'right') - 1, 0, n_bins - 1)
+        # Rows are in time order, so every bin is one run of rows
+        runs = np.flatnonzero(np.diff(bins, prepend=-1))
+        sums[bins[runs]] += np.add.reduceat(np.asarray(data[start:stop], dtype=np.float64), runs, axis=0)
+        counts += np.bincount(bins, minlength=n_bins)
+    with np.errstate(invalid='ignore'):
+        return sums / counts[:, np.newaxis]
+
+
+def difference_waterfall(data_a, seconds_a, frequencies_a, data_b, seconds_b, frequencies_b, grid, n_bins,
+                         align='absolute'):
+    """
+    B minus A, sweep-averaged in `n_bins` time bins and interpolated onto `grid`.
+
+    With align='absolute' the bins cover the time both captures were
+    recording, with align='start' the first seconds of both (for captures
+    of different days). Returns (difference, bin start seconds), or None
+    when the time ranges do not overlap.
+    """
+    if align == 'start':
+        seconds_a = seconds_a - seconds_a[0]
+        seconds_b = seconds_b - seconds_b[0]
+    low = max(seconds_a[0], seconds_b[0])
+    high = min(seconds_a[-1], seconds_b[-1])
+    if low > high:
+        return None
+    # A bin is never shorter than a sweep of the slower capture
+    sweep = max(np.diff(seconds_a[:2]).sum(), np.diff(seconds_b[:2]).sum(), 1e-6)
+    n_bins = int(max(1, min(n_bins, (high - low) // sweep + 1)))
+    edges = np.linspace(low, high + sweep, n_bins + 1)
+    a = interpolate_columns(binned_sweeps(data_a, seconds_a, edges), frequencies_a, grid)
+    b = interpolate_columns(binned_sweeps(data_b, seconds_b, edges), frequencies_b, grid)
+    return b - a, edges[:-1]
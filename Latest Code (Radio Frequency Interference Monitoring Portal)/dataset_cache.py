@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+
+class DatasetCache:
+    """
+    Least recently used cache of opened captures, bounded by their size in bytes.
+
+    `load(name)` opens a capture from the store and returns None when there
+    is no such capture. The captures are memmaps, so the budget bounds how
+    much of the store is mapped, and can be paged into the server's memory,
+    at once. An evicted capture is unmapped as soon as no request uses it
+    any more and is reopened by `load` on its next access. The most recently
+    used capture is always kept, even when it alone exceeds `max_bytes`.
+
+    `version(name)`, when given, returns a token of the stored copy (see
+    capture_store.store_version). It is checked on every access, so a
+    capture converted again or removed by another server process is
+    reopened or dropped rather than served from the old mapping.
+    """
+
+    def __init__(self, load, max_bytes=None, version=None):
+        self.load = load
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, name):
+        """The capture `name`, loaded on a miss, or None."""
+        token = self.version(name) if self.version is not None and name else None
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] == token:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry[0]
+            # Not opened yet, or stored again since it was opened
+            self._discard(name)
+            self.misses += 1
+        # Opening reads the sidecar, other requests need not wait for it
+        data = self.load(name) if name else None
+        if data is not None:
+            self.put(name, data, token)
+        return data
+
+    def put(self, name, data, token=None):
+        """
+        Adds or replaces a capture and evicts the least recently used ones
+        beyond the budget. `token` defaults to the current version of `name`.
+        """
+        if token is None and self.version is not None:
+            token = self.version(name)
+        with self._lock:
+            self._discard(name)
+            self._entries[name] = (data, token)
+            self._bytes += data.nbytes
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, name):
+        """Forgets a capture, e.g. after it was removed from the store."""
+        with self._lock:
+            self._discard(name)
+
+    def _discard(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._bytes -= entry[0].nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
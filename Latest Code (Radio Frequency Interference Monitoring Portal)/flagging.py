@@ -0,0 +1,235 @@
+import numpy as np
+
+from capture_store import discard, open_capture, publish, read_meta, remove_capture, store_paths, write_meta
+from pyramid import pool
+from quantile_sketch import QuantileSketch, sketch_capture
+
+MAD_SCALE = 1.4826  # MAD of Gaussian noise times MAD_SCALE is its standard deviation
+THRESHOLD = 6.0  # Single-sample threshold of SumThreshold, in robust standard deviations
+LENGTHS = (1, 2, 4, 8, 16, 32)  # SumThreshold window lengths, in samples
+RHO = 1.5  # The threshold of a window of M samples is THRESHOLD / RHO**log2(M)
+
+
+def channel_statistics(data, median=None, block_rows=16384, exact_max_rows=100000, min_sigma=0.01):
+    """
+    Per-channel median and robust standard deviation (MAD_SCALE x MAD) of a capture.
+
+    Captures of up to `exact_max_rows` sweeps get exact values. Larger ones
+    are read block by block into quantile sketches, within 0.025 dB of the
+    exact median and a few hundredths of a dB of the exact sigma. A
+    per-channel `median` that is already known (e.g. the portal's spectrum)
+    skips its computation.
+
+    Returns (median, sigma) as float32 arrays of one value per channel,
+    sigma being at least `min_sigma`.
+    """
+    if len(data) <= exact_max_rows:
+        block = np.asarray(data, dtype=np.float32)
+        if median is None:
+            median = np.nanmedian(block, axis=0)
+        mad = np.nanmedian(np.abs(block - median), axis=0)
+    else:
+        if median is None:
+            median = sketch_capture(data, block_rows).median()
+        deviations = QuantileSketch(data.shape[1], lo=0.0, hi=100.0, bin_width=0.01)
+        for start in range(0, len(data), block_rows):
+            deviations.update(np.abs(data[start:start + block_rows] - median))
+        mad = deviations.median()
+    sigma = np.maximum(np.nan_to_num(MAD_SCALE * mad, nan=min_sigma), min_sigma)
+    return np.asarray(median, dtype=np.float32), sigma.astype(np.float32)
+
+
+def window_sums(values, length):
+    """
+    Sums of every `length` consecutive rows of `values` (n - length + 1 of them).
+
+    Built by doubling: sums of 1, 2, 4, ... rows are each one vectorized
+    addition of the previous ones, and the binary digits of `length` pick
+    which of them add up to the window, so there are O(log length) passes
+    over the data and no running sums that lose float32 precision.
+    """
+    n = len(values)
+    total = None
+    offset = 0
+    width = 1
+    sums = values
+    remaining = length
+    while True:
+        if remaining & 1:
+            part = sums[offset:offset + n - length + 1]
+            total = part.copy() if total is None else np.add(total, part, out=total)
+            offset += width
+        remaining >>= 1
+        if not remaining:
+            return total
+        sums = sums[:-width] + sums[width:]
+        width *= 2
+
+
+def spread(hits, length):
+    """Rows covered by the windows of `length` rows that start where `hits` is True."""
+    n = len(hits) + length - 1
+    # covered[i] ends up as any(hits[i - length + 1..i]), by doubling as in window_sums
+    covered = np.zeros((n + length - 1,) + hits.shape[1:], dtype=bool)
+    covered[length - 1:length - 1 + len(hits)] = hits
+    width = 1
+    while width < length:
+        step = min(width, length - width)
+        covered[:-step] |= covered[step:]
+        width += step
+    return covered[:n]
+
+
+def sum_threshold(residual, mask, axis=0, threshold=THRESHOLD, lengths=LENGTHS, rho=RHO):
+    """
+    SumThreshold (Offringa et al. 2010) along one axis, updating `mask` in place.
+
+    For every window length M, M consecutive samples are flagged together
+    when their sum exceeds M x threshold / rho**log2(M). Samples flagged
+    already count as exactly that threshold, so they neither trigger nor
+    hide a window. Short strong bursts are caught by the short windows,
+    weak but long or wide ones by the long windows.
+
+    Parameters:
+    ----------
+    residual : numpy.ndarray
+        2D float32 excess power in robust standard deviations, (data - median) / sigma.
+    mask : numpy.ndarray
+        Boolean array of the same shape, True for flagged samples.
+    axis : int
+        0 runs the windows along time, 1 along frequency.
+    """
+    if axis == 1:
+        # Windows along rows of a contiguous transposed copy are about twice as fast
+        flags = np.ascontiguousarray(mask.T)
+        sum_threshold(np.ascontiguousarray(residual.T), flags, 0, threshold, lengths, rho)
+        mask[...] = flags.T
+        return mask
+    for length in lengths:
+        if length > len(residual):
+            break
+        chi = np.float32(threshold / rho ** np.log2(length))
+        hits = window_sums(np.where(mask, chi, residual), length) > length * chi
+        mask |= spread(hits, length)
+    return mask
+
+
+def flag_block(block, median, sigma, threshold=THRESHOLD, lengths=LENGTHS, rho=RHO):
+    """
+    RFI mask of a (sweeps, channels) block: SumThreshold across time, then across frequency.
+
+    Only excess power is flagged. NaN samples are never flagged.
+    """
+    residual = np.nan_to_num((np.asarray(block, dtype=np.float32) - median) / sigma, nan=0.0)
+    mask = np.zeros(residual.shape, dtype=bool)
+    sum_threshold(residual, mask, 0, threshold, lengths, rho)
+    sum_threshold(residual, mask, 1, threshold, lengths, rho)
+    return mask
+
+
+def flag_capture(data, median, sigma, out=None, block_rows=16384, threshold=THRESHOLD, lengths=LENGTHS, rho=RHO):
+    """
+    Flags a whole (possibly memory-mapped) capture block by block.
+
+    Every block is read with sum(length - 1) sweeps of context on both
+    sides: a window of M sweeps can extend the flags of the shorter windows
+    by M - 1 sweeps, so a flag depends on samples that far away at most and
+    the blocks get the same mask as one pass over the capture. The mask is
+    written into `out` when given (e.g. a memmap in the store), otherwise
+    it is returned as a new boolean array.
+    """
+    if out is None:
+        out = np.empty(data.shape, dtype=bool)
+    margin = sum(length - 1 for length in lengths)
+    for start in range(0, len(data), block_rows):
+        stop = min(start + block_rows, len(data))
+        first = max(start - margin, 0)
+        mask = flag_block(data[first:min(stop + margin, len(data))], median, sigma, threshold, lengths, rho)
+        out[start:stop] = mask[start - first:stop - first]
+    return out
+
+
+def clean_median(data, mask, block_rows=16384, exact_max_rows=100000):
+    """
+    Per-channel median of the samples not flagged in `mask`, NaN for channels flagged entirely.
+
+    Exact up to `exact_max_rows` sweeps, from a quantile sketch (within
+    0.025 dB) beyond.
+    """
+    if len(data) <= exact_max_rows:
+        return np.nanmedian(np.where(mask, np.nan, np.asarray(data, dtype=np.float32)), axis=0)
+    sketch = QuantileSketch(data.shape[1])
+    for start in range(0, len(data), block_rows):
+        sketch.update(np.where(mask[start:start + block_rows], np.nan, data[start:start + block_rows]))
+    return sketch.median()
+
+
+def flag_fraction(mask, time_factor, freq_factor, block_rows=16384):
+    """Fraction of flagged samples in every time_factor x freq_factor cell, e.g. of a waterfall level."""
+    rows, cols = mask.shape
+    out = np.empty((-(-rows // time_factor), -(-cols // freq_factor)), dtype=np.float32)
+    step = max(block_rows // time_factor, 1) * time_factor
+    for start in range(0, rows, step):
+        pooled = pool(np.asarray(mask[start:start + step], dtype=np.float32), time_factor, freq_factor, 'mean')
+        out[start // time_factor:start // time_factor + len(pooled)] = pooled
+    return out
+
+
+def flags_name(name):
+    """Store name of the RFI mask of capture `name`."""
+    return name + '.flags'
+
+
+def open_flags(store_folder, name, params):
+    """
+    Stored RFI mask of a capture, or None when there is none for `params`
+    or the capture was converted again since it was flagged.
+    """
+    meta = read_meta(store_folder, flags_name(name))
+    capture_meta = read_meta(store_folder, name)
+    if meta is None or capture_meta is None or meta.get('params') != params:
+        return None
+    if meta.get('source') != [capture_meta.get('source_size'), capture_meta.get('source_mtime')]:
+        return None
+    return open_capture(store_folder, flags_name(name))[0]
+
+
+def flag_stored(store_folder, name, median, sigma, threshold=THRESHOLD, lengths=LENGTHS, rho=RHO):
+    """
+    Flags a stored capture into `<name>.flags` (one byte per sample) next to it.
+
+    Returns the mask opened read-only.
+    """
+    data, capture_meta = open_capture(store_folder, name)
+    meta = {
+        'name': flags_name(name),
+        'dtype': np.dtype(np.bool_).str,
+        'shape': list(data.shape),
+        'params': flag_params(threshold, lengths, rho),
+        'source': [capture_meta.get('source_size'), capture_meta.get('source_mtime')],
+    }
+    if not len(data):
+        write_meta(store_folder, flags_name(name), meta)
+        return open_capture(store_folder, flags_name(name))[0]
+    # Written next to an older mask and swapped in, like the pyramid levels
+    tmp_path = store_paths(store_folder, flags_name(name))[0] + '.tmp'
+    try:
+        out = np.memmap(tmp_path, dtype=np.bool_, mode='w+', shape=data.shape)
+        flag_capture(data, median, sigma, out=out, threshold=threshold, lengths=lengths, rho=rho)
+        out.flush()
+        del out
+        publish(store_folder, flags_name(name), tmp_path, meta)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return open_capture(store_folder, flags_name(name))[0]
+
+
+def flag_params(threshold=THRESHOLD, lengths=LENGTHS, rho=RHO):
+    """Flagging parameters as stored in the sidecar of a mask."""
+    return {'threshold': float(threshold), 'lengths': [int(length) for length in lengths], 'rho': float(rho)}
+
+
+def remove_flags(store_folder, name):
+    """Deletes the stored RFI mask of a capture."""
+    remove_capture(store_folder, flags_name(name))
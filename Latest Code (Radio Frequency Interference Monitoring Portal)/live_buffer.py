@@ -0,0 +1,331 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from capture_store import parse_hdr, store_paths, write_meta
+from time_axis import build_time_axis
+
+
+class LiveBuffer:
+    """
+    Append-only store of live sweeps in preallocated fixed-size chunks.
+
+    Appending writes into the free rows of the last chunk and allocates a new
+    chunk of `chunk_rows` sweeps when it is full, so the cost of an append
+    depends only on the number of sweeps appended, never on what is already
+    buffered, and existing sweeps are never copied.
+
+    A `seed` (e.g. the memmap of an uploaded capture) makes its sweeps the
+    first rows of the buffer without reading them; they are only read when
+    a view or rows() needs them.
+    """
+
+    def __init__(self, n_channels, dtype='float32', chunk_rows=4096, seed=None):
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self._seed = seed
+        self._seed_rows = len(seed) if seed is not None else 0
+        self._chunks = []
+        self._rows = self._seed_rows
+        self._view = None  # Sweeps 0.._view_rows as one array, with room to grow
+        self._view_rows = 0
+        self._lock = threading.Lock()
+        self._view_lock = threading.Lock()
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def first_row(self):
+        """Index of the oldest sweep still held, always 0 here."""
+        return 0
+
+    @property
+    def shape(self):
+        return (self._rows, self.n_channels)
+
+    def append(self, sweeps):
+        """Appends one sweep (1D) or a block of sweeps (2D). Returns the new number of sweeps."""
+        sweeps = np.asarray(sweeps, dtype=self.dtype)
+        if sweeps.ndim == 1:
+            sweeps = sweeps[np.newaxis, :]
+        if sweeps.shape[1] != self.n_channels:
+            raise ValueError('Expected {} values per sweep, got {}'.format(self.n_channels, sweeps.shape[1]))
+        with self._lock:
+            done = 0
+            while done < len(sweeps):
+                appended = self._rows - self._seed_rows
+                used = appended % self.chunk_rows
+                if used == 0 and appended == len(self._chunks) * self.chunk_rows:
+                    self._chunks.append(np.empty((self.chunk_rows, self.n_channels), dtype=self.dtype))
+                take = min(self.chunk_rows - used, len(sweeps) - done)
+                self._chunks[-1][used:used + take] = sweeps[done:done + take]
+                done += take
+                self._rows += take
+            return self._rows
+
+    def rows(self, start, stop=None):
+        """Copy of sweeps start..stop (default: up to the end)."""
+        with self._lock:
+            stop = self._rows if stop is None else min(stop, self._rows)
+            chunks = list(self._chunks)
+        # Rows below stop are never written again, they are copied without the lock
+        start = max(0, min(start, stop))
+        if start == stop:
+            return np.empty((0, self.n_channels), dtype=self.dtype)
+        parts = []
+        if start < self._seed_rows:
+            parts.append(np.asarray(self._seed[start:min(stop, self._seed_rows)], dtype=self.dtype))
+        start = max(start, self._seed_rows) - self._seed_rows
+        stop -= self._seed_rows
+        if start < stop:
+            first, last = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+            for index in range(first, last + 1):
+                begin = max(start - index * self.chunk_rows, 0)
+                end = min(stop - index * self.chunk_rows, self.chunk_rows)
+                parts.append(chunks[index][begin:end])
+        return np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+
+    def snapshot(self):
+        """
+        Records the current number of sweeps, O(1). The returned function
+        gives them as one contiguous array and may be called after further
+        appends, without holding any lock against them.
+        """
+        rows = self._rows
+        return lambda: self.view(rows)
+
+    def view(self, rows=None):
+        """
+        Sweeps 0..rows (default: all) as one contiguous array.
+
+        The array is kept and extended in place by the sweeps appended since
+        the last view, so a view only copies the new sweeps (and, now and
+        then, the kept array when it has to grow). Returned views are never
+        modified afterwards.
+        """
+        with self._view_lock:
+            rows = self._rows if rows is None else min(rows, self._rows)
+            if rows > self._view_rows:
+                if self._view is None or rows > len(self._view):
+                    # Room for a quarter more, a seeded buffer may be as large as a capture
+                    grown = np.empty((rows + max(rows // 4, self.chunk_rows), self.n_channels), dtype=self.dtype)
+                    if self._view is not None:
+                        grown[:self._view_rows] = self._view[:self._view_rows]
+                    self._view = grown
+                self._view[self._view_rows:rows] = self.rows(self._view_rows, rows)
+                self._view_rows = rows
+            if self._view is None:
+                return np.empty((0, self.n_channels), dtype=self.dtype)
+            return self._view[:rows]
+
+
+class RollingBuffer:
+    """
+    Fixed-memory live buffer holding the last `capacity` sweeps.
+
+    The sweeps are kept in a circular array. Sweeps pushed out of it are
+    appended to segment files in the capture store (`<prefix>_<time>_<row>`,
+    the same .dat + .json format as uploaded captures), so a multi-day run
+    keeps a flat memory footprint and the older data stays readable with
+    capture_store.open_capture. A segment is closed after `segment_rows`
+    sweeps and `on_segment(name)` is called for it.
+
+    Segment sidecars carry the live capture's `hdr_content` (which may be
+    set after construction, e.g. once an acquisition has started), the
+    absolute index of their first sweep as 'first_row' and, when the HDR
+    gives a start and sweep time, its timestamp as 'start_time', so a
+    segment is placed on the time axis like an upload.
+
+    Row indices are absolute: len() counts every sweep ever appended
+    (starting at `start_row`) and rows() accepts indices from first_row on.
+    """
+
+    def __init__(self, n_channels, capacity, store_folder, dtype='float32', segment_rows=100000,
+                 prefix='live', start_row=0, on_segment=None, hdr_content=None):
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.store_folder = store_folder
+        self.dtype = np.dtype(dtype)
+        self.segment_rows = segment_rows
+        self.prefix = prefix
+        self.on_segment = on_segment
+        self.hdr_content = hdr_content
+        self._ring = np.empty((capacity, n_channels), dtype=self.dtype)
+        self._start_row = start_row
+        self._rows = start_row
+        self._segment = None  # [name, file, meta]
+        self._view = None  # Sweeps held at the last view, ending at row _view_rows
+        self._view_rows = 0
+        self._lock = threading.Lock()
+        self._view_lock = threading.Lock()
+        if not os.path.exists(store_folder):
+            os.makedirs(store_folder)
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def shape(self):
+        return (self._rows - self.first_row, self.n_channels)
+
+    @property
+    def first_row(self):
+        """Index of the oldest sweep still held in memory."""
+        return max(self._start_row, self._rows - self.capacity)
+
+    def _spill(self, sweeps, first):
+        # Appends sweeps `first`.. to the open segment, rotating it when full
+        done = 0
+        while done < len(sweeps):
+            if self._segment is None:
+                name = '{}_{}_{}'.format(self.prefix, time.strftime('%Y%m%d_%H%M%S'), first + done)
+                data_path, _ = store_paths(self.store_folder, name)
+                meta = {'name': name, 'dtype': self.dtype.str, 'shape': [0, self.n_channels],
+                        'source': None, 'hdr_content': self.hdr_content, 'hdr': parse_hdr(self.hdr_content),
+                        'first_row': first + done, 'start_time': self._row_time(first + done)}
+                self._segment = [name, open(data_path, 'ab'), meta]
+            name, segment_file, meta = self._segment
+            take = min(self.segment_rows - meta['shape'][0], len(sweeps) - done)
+            np.ascontiguousarray(sweeps[done:done + take]).tofile(segment_file)
+            segment_file.flush()
+            meta['shape'][0] += take
+            write_meta(self.store_folder, name, meta)
+            done += take
+            if meta['shape'][0] >= self.segment_rows:
+                self._close_segment()
+
+    def _row_time(self, row):
+        # ISO timestamp of sweep `row`, None without a start and sweep time
+        hdr = parse_hdr(self.hdr_content)
+        if hdr.get('Start time') is None or hdr.get('Sweep time') is None:
+            return None
+        return str(build_time_axis(1, hdr['Start time'], hdr['Sweep time'], system_date=hdr.get('System date'),
+                                   first_sweep=row)[0])
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        name, segment_file, _ = self._segment
+        segment_file.close()
+        self._segment = None
+        if self.on_segment is not None:
+            self.on_segment(name)
+
+    def append(self, sweeps):
+        """Appends one sweep (1D) or a block of sweeps (2D). Returns the new number of sweeps."""
+        sweeps = np.asarray(sweeps, dtype=self.dtype)
+        if sweeps.ndim == 1:
+            sweeps = sweeps[np.newaxis, :]
+        if sweeps.shape[1] != self.n_channels:
+            raise ValueError('Expected {} values per sweep, got {}'.format(self.n_channels, sweeps.shape[1]))
+        with self._lock:
+            held = self._rows - self.first_row
+            # Oldest held sweeps that the new ones push out of the ring
+            evicted = max(0, min(held + len(sweeps) - self.capacity, held))
+            if evicted:
+                self._spill(self._take(self.first_row, self.first_row + evicted), self.first_row)
+            # New sweeps that do not fit in the ring at all
+            overflow = max(0, len(sweeps) - self.capacity)
+            if overflow:
+                self._spill(sweeps[:overflow], self._rows)
+            positions = np.arange(self._rows, self._rows + len(sweeps)) % self.capacity
+            self._ring[positions[overflow:]] = sweeps[overflow:]
+            self._rows += len(sweeps)
+            return self._rows
+
+    def _take(self, start, stop):
+        return self._ring[np.arange(start, stop) % self.capacity]
+
+    def rows(self, start, stop=None):
+        """Copy of sweeps start..stop still held in memory (default: up to the end)."""
+        with self._lock:
+            stop = self._rows if stop is None else min(stop, self._rows)
+            start = max(start, self.first_row)
+            if start >= stop:
+                return np.empty((0, self.n_channels), dtype=self.dtype)
+            return self._take(start, stop)
+
+    def snapshot(self):
+        """
+        Copies the sweeps appended since the last view out of the ring,
+        O(new sweeps). Must not run concurrently with appends, which
+        overwrite the ring. The returned function gives all the sweeps held
+        at this moment, oldest first, as one array, and may be called after
+        further appends without holding any lock against them.
+        """
+        rows, first = self._rows, self.first_row
+        with self._view_lock:
+            base, base_rows = self._view, self._view_rows
+        # Sweeps first..start are in the last view already
+        start = max(base_rows, first) if base is not None else first
+        new = self.rows(start, rows)
+
+        def view():
+            if start > first:
+                view = np.concatenate([base[len(base) - (start - first):], new])
+            else:
+                view = new
+            with self._view_lock:
+                if rows > self._view_rows:
+                    self._view, self._view_rows = view, rows
+            return view
+        return view
+
+    def view(self):
+        """The sweeps held in memory, oldest first. Must not run concurrently with appends."""
+        return self.snapshot()()
+
+    def close(self):
+        """Writes the sweeps still in memory to the store and closes the open segment."""
+        with self._lock:
+            if self._rows > self.first_row:
+                self._spill(self._take(self.first_row, self._rows), self.first_row)
+                self._start_row = self._rows
+            self._close_segment()
+
+
+class ReadWriteLock:
+    """
+    Lock held by any number of readers or by one writer.
+
+    A waiting writer keeps new readers out, so a steady stream of readers
+    cannot hold back the appends of a live capture.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
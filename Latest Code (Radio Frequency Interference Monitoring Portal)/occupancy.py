@@ -0,0 +1,196 @@
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from capture_store import find_hdr, parse_hdr, sniff_csv, sweep_values
+from time_axis import build_time_axis
+
+THRESHOLD = -80.0  # dBm above which a channel counts as occupied
+CHUNK_ROWS = 20000  # Sweeps parsed at a time, about 80 MB of float32 at 1001 points
+
+
+class Occupancy:
+    """
+    Per-channel counts of sweeps above a threshold, over all sweeps and per hour of day.
+
+    Counts of several captures (or several processes) add up with `merge`,
+    so a campaign is summed one capture at a time and never held in memory.
+    """
+
+    def __init__(self, n_channels, start_frequency=None, stop_frequency=None):
+        self.n_channels = n_channels
+        self.start_frequency = start_frequency
+        self.stop_frequency = stop_frequency
+        self.sweeps = 0
+        self.above = np.zeros(n_channels, dtype=np.int64)
+        self.hour_sweeps = np.zeros(24, dtype=np.int64)  # Only sweeps with a known time of day
+        self.hour_above = np.zeros((24, n_channels), dtype=np.int64)
+        self.captures = []
+
+    def add(self, values, threshold, hours=None):
+        """Counts a (sweeps, n_channels) block, `hours` being the hour of day of every sweep."""
+        above = values > threshold  # NaN is never above
+        self.sweeps += len(values)
+        self.above += above.sum(axis=0)
+        if hours is not None:
+            self.hour_sweeps += np.bincount(hours, minlength=24)
+            # A block spans a few hours at most
+            for hour in np.unique(hours):
+                self.hour_above[hour] += above[hours == hour].sum(axis=0)
+
+    def merge(self, other):
+        self.sweeps += other.sweeps
+        self.above += other.above
+        self.hour_sweeps += other.hour_sweeps
+        self.hour_above += other.hour_above
+        self.captures += other.captures
+
+    def spectrum(self):
+        """Percentage of sweeps above the threshold, per channel."""
+        return 100.0 * self.above / max(self.sweeps, 1)
+
+    def hourly(self):
+        """(24, n_channels) percentage of the sweeps of every hour of day above the threshold, NaN for hours without sweeps."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 100.0 * self.hour_above / self.hour_sweeps[:, np.newaxis]
+
+    def frequencies(self):
+        """Frequency of every channel in Hz, channel indices without an HDR."""
+        if self.start_frequency is None:
+            return np.arange(self.n_channels, dtype=float)
+        return np.linspace(self.start_frequency, self.stop_frequency, self.n_channels)
+
+
+def find_captures(paths):
+    """Capture CSVs among `paths`: CSV files as given, folders searched recursively."""
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            captures += sorted(glob.glob(os.path.join(path, '**', '*.csv'), recursive=True))
+        else:
+            captures.append(path)
+    return captures
+
+
+def read_capture_hdr(csv_path):
+    """HDR of a capture, from the HDR file next to the CSV (see capture_store.find_hdr), {} without one."""
+    hdr_path = find_hdr(csv_path)
+    if hdr_path is None:
+        return {}
+    with open(hdr_path, 'r') as f:
+        return parse_hdr(f.read())
+
+
+def capture_occupancy(job):
+    """
+    Occupancy of one capture CSV, parsed CHUNK_ROWS sweeps at a time.
+
+    `job` is (csv_path, threshold, chunk_rows), so that it can be mapped
+    over a process pool. Returns (csv_path, Occupancy or None, error, seconds).
+    """
+    csv_path, threshold, chunk_rows = job
+    begin = time.time()
+    try:
+        hdr = read_capture_hdr(csv_path)
+        n_values, has_header = sniff_csv(csv_path)
+        occupancy = Occupancy(n_values, hdr.get('Start frequency'), hdr.get('Stop frequency'))
+        timed = hdr.get('Start time') is not None and hdr.get('Sweep time') is not None
+        reader = pd.read_csv(csv_path, header=None, skiprows=1 if has_header else 0,
+                             dtype=np.float32, chunksize=chunk_rows)
+        row = 0
+        for chunk in reader:
+            values = sweep_values(chunk, n_values, csv_path)
+            hours = None
+            if timed:
+                times = build_time_axis(len(values), hdr['Start time'], hdr['Sweep time'],
+                                        system_date=hdr.get('System date'), first_sweep=row)
+                hours = ((times - times.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.intp)
+            occupancy.add(values, threshold, hours)
+            row += len(values)
+        occupancy.captures.append(csv_path)
+        return csv_path, occupancy, None, time.time() - begin
+    except Exception as e:
+        return csv_path, None, str(e), time.time() - begin
+
+
+def campaign_occupancy(paths, threshold=THRESHOLD, processes=None, chunk_rows=CHUNK_ROWS):
+    """
+    Occupancy of every capture under `paths`, one capture per worker process.
+
+    Captures on different frequency grids are not comparable channel by
+    channel, so the result is a dict from (start frequency, stop frequency,
+    channels) to the merged Occupancy of the captures on that grid.
+    """
+    jobs = [(csv_path, threshold, chunk_rows) for csv_path in find_captures(paths)]
+    results = {}
+    with multiprocessing.Pool(processes) as pool:
+        # Workers only send back the counts, a few hundred kB per capture
+        for csv_path, occupancy, error, seconds in pool.imap_unordered(capture_occupancy, jobs):
+            if error is not None:
+                print('{}: skipped, {}'.format(csv_path, error))
+                continue
+            print('{}: {} sweeps in {:.1f} s'.format(csv_path, occupancy.sweeps, seconds))
+            grid = (occupancy.start_frequency, occupancy.stop_frequency, occupancy.n_channels)
+            if grid in results:
+                results[grid].merge(occupancy)
+            else:
+                results[grid] = occupancy
+    return results
+
+
+def write_occupancy(occupancy, prefix, threshold=THRESHOLD):
+    """
+    Writes <prefix>_spectrum.csv, <prefix>_hourly.csv and a <prefix>.png of both.
+
+    The spectrum has one row per channel (frequency in Hz, percentage of
+    sweeps above the threshold), the hourly matrix one row per hour of day
+    and one column per channel.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    frequencies = occupancy.frequencies()
+    pd.DataFrame({'frequency_hz': frequencies, 'occupancy_percent': occupancy.spectrum()}).to_csv(
+        prefix + '_spectrum.csv', index=False, float_format='%.4f')
+    hourly = pd.DataFrame(occupancy.hourly(), columns=frequencies)
+    hourly.insert(0, 'sweeps', occupancy.hour_sweeps)
+    hourly.index.name = 'hour'
+    hourly.to_csv(prefix + '_hourly.csv', float_format='%.4f')
+
+    x = frequencies / 1e9 if occupancy.start_frequency is not None else frequencies
+    x_label = 'Frequency [GHz]' if occupancy.start_frequency is not None else 'Channel'
+    figure, (top, bottom) = plt.subplots(2, 1, figsize=(12, 9), sharex=True)
+    top.plot(x, occupancy.spectrum(), linewidth=0.8)
+    top.set_ylabel('Occupancy [%]')
+    top.set_title('{} captures, {} sweeps, threshold {:g} dBm'.format(
+        len(occupancy.captures), occupancy.sweeps, threshold))
+    image = bottom.imshow(occupancy.hourly(), aspect='auto', origin='lower', cmap='inferno', vmin=0, vmax=100,
+                          extent=(x[0], x[-1], 0, 24), interpolation='nearest')
+    bottom.set_xlabel(x_label)
+    bottom.set_ylabel('Hour of day')
+    figure.colorbar(image, ax=[top, bottom], label='Occupancy [%]')
+    figure.savefig(prefix + '.png', dpi=150)
+    plt.close(figure)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print("Usage: python occupancy.py <output_prefix> <threshold_dBm> <folder_or_csv> [...]")
+        sys.exit(1)
+    prefix = sys.argv[1]
+    threshold = float(sys.argv[2])
+    results = campaign_occupancy(sys.argv[3:], threshold)
+    if not results:
+        print('No captures found')
+        sys.exit(1)
+    for index, (grid, occupancy) in enumerate(sorted(results.items(), key=lambda item: -item[1].sweeps)):
+        # The grid with the most sweeps gets the plain prefix
+        output = prefix if index == 0 else '{}_{}'.format(prefix, index)
+        write_occupancy(occupancy, output, threshold)
+        print('{}: {} captures, {} sweeps, {} channels'.format(output, len(occupancy.captures), occupancy.sweeps, grid[2]))
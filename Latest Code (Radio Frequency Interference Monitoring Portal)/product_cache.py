@@ -0,0 +1,106 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def product_bytes(value):
+    """Approximate memory held by a product: arrays, strings, and the containers and objects holding them."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(product_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(product_bytes(item) for item in value)
+    if hasattr(value, '__dict__'):
+        # e.g. a QuantileSketch, whose histograms are an array attribute
+        return sys.getsizeof(value) + product_bytes(vars(value))
+    return sys.getsizeof(value)
+
+
+class ProductCache:
+    """
+    Cache of the products derived from a dataset (medians, time axis, figure JSON).
+
+    Entries are keyed by (dataset, version, product, params). `params` holds
+    everything else the product depends on, e.g. a hash of the HDR content
+    or the display parameters of a figure. Invalidating a dataset bumps its
+    version, so products computed before an append are never served again.
+    `validate` does the same when the stored copy of a dataset changed in
+    another process.
+
+    The least recently used entries are dropped once the products together
+    exceed `max_bytes` (see product_bytes), so a few large figures or
+    sketches, or a live capture adding products for every new row count,
+    cannot grow the cache without bound. The most recently added product is
+    always kept, even when it alone exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, bytes)
+        self._bytes = 0
+        self._versions = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _key(self, dataset, product, params):
+        return (dataset, self._versions.get(dataset, 0), product, params)
+
+    def get(self, dataset, product, params=()):
+        """Cached product, or None."""
+        with self._lock:
+            key = self._key(dataset, product, params)
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, dataset, product, params, value):
+        size = product_bytes(value)
+        with self._lock:
+            key = self._key(dataset, product, params)
+            self._discard(key)
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+
+    def get_or_compute(self, dataset, product, params, compute):
+        """Cached product, computed with compute() and stored on a miss."""
+        value = self.get(dataset, product, params)
+        if value is None:
+            value = compute()
+            self.put(dataset, product, params, value)
+        return value
+
+    def invalidate(self, dataset):
+        """Forgets every product of `dataset`, e.g. after new sweeps were appended."""
+        with self._lock:
+            self._invalidate(dataset)
+
+    def validate(self, dataset, token):
+        """
+        Forgets every product of `dataset` if `token` (see
+        capture_store.store_version) differs from the one seen last time,
+        i.e. the capture was uploaded again or removed since.
+        """
+        with self._lock:
+            if dataset in self._tokens and self._tokens[dataset] != token:
+                self._invalidate(dataset)
+            self._tokens[dataset] = token
+
+    def _invalidate(self, dataset):
+        self._versions[dataset] = self._versions.get(dataset, 0) + 1
+        for key in [key for key in self._entries if key[0] == dataset]:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,183 @@
+import numpy as np
+
+from capture_store import discard, open_capture, publish, read_meta, remove_capture, store_paths, write_meta
+
+POOLING_MODES = ('max', 'mean', 'median')
+
+
+def pool(block, time_factor, freq_factor, mode='max'):
+    """
+    Reduces every time_factor x freq_factor cell of `block` to one value.
+
+    Parameters:
+    ----------
+    block : numpy.ndarray
+        2D array, rows are sweeps and columns are frequency channels.
+    time_factor, freq_factor : int
+        Number of sweeps and channels pooled together.
+    mode : str
+        'max' keeps narrowband or short bursts of RFI visible, 'mean' gives
+        the average power and 'median' the typical level of each cell.
+
+    Returns:
+    -------
+    numpy.ndarray of shape (ceil(rows / time_factor), ceil(cols / freq_factor)).
+    A partial cell at the end of an axis is padded by repeating its last
+    sweep or channel.
+    """
+    if mode not in POOLING_MODES:
+        raise ValueError('Unknown pooling mode: ' + str(mode))
+    if time_factor == 1 and freq_factor == 1:
+        return np.asarray(block)
+    rows, cols = block.shape
+    out_rows = -(-rows // time_factor)
+    out_cols = -(-cols // freq_factor)
+    pad = ((0, out_rows * time_factor - rows), (0, out_cols * freq_factor - cols))
+    if pad[0][1] or pad[1][1]:
+        block = np.pad(block, pad, mode='edge')
+    cells = np.asarray(block).reshape(out_rows, time_factor, out_cols, freq_factor)
+    if mode == 'max':
+        return cells.max(axis=(1, 3))
+    elif mode == 'mean':
+        return cells.mean(axis=(1, 3), dtype=np.float64).astype(block.dtype)
+    cells = cells.transpose(0, 2, 1, 3).reshape(out_rows, out_cols, time_factor * freq_factor)
+    return np.median(cells, axis=2).astype(block.dtype)
+
+
+def decimate(data, time_factor, freq_factor, mode='max', block_rows=16384, out=None):
+    """
+    Pools a whole (possibly memory-mapped) capture block by block.
+
+    Only `block_rows` sweeps are read at a time. The result is written into
+    `out` when given (e.g. a memmap of the next pyramid level), otherwise it
+    is returned as a new array.
+    """
+    rows, cols = data.shape
+    out_shape = (-(-rows // time_factor), -(-cols // freq_factor))
+    if out is None:
+        out = np.empty(out_shape, dtype=data.dtype)
+    step = max(block_rows // time_factor, 1) * time_factor
+    for start in range(0, rows, step):
+        pooled = pool(data[start:start + step], time_factor, freq_factor, mode)
+        out[start // time_factor:start // time_factor + len(pooled)] = pooled
+    return out
+
+
+def level_name(name, level, mode):
+    """Store name of pyramid `level` of capture `name`."""
+    return '{}.L{}.{}'.format(name, level, mode)
+
+
+def pyramid_levels(shape, min_rows=256, min_cols=512):
+    """
+    The (time_factor, freq_factor) of every level for a capture of `shape`.
+
+    Each level halves the number of sweeps of the previous one until it has
+    at most `min_rows`. The frequency axis is halved too, but only while it
+    has more than `min_cols` channels, so the spectral resolution never drops
+    below roughly the width of the plot.
+    """
+    rows, cols = shape
+    levels = [(1, 1)]
+    while rows > min_rows:
+        time_factor, freq_factor = levels[-1]
+        halve_cols = cols > min_cols
+        rows = -(-rows // 2)
+        cols = -(-cols // 2) if halve_cols else cols
+        levels.append((time_factor * 2, freq_factor * 2 if halve_cols else freq_factor))
+    return levels
+
+
+def has_pyramid(meta, modes):
+    """True if the sidecar records a pyramid with all the pooling `modes`."""
+    pyramid = (meta or {}).get('pyramid')
+    return pyramid is not None and all(mode in pyramid['modes'] for mode in modes)
+
+
+def build_pyramid(store_folder, name, modes=('max',), min_rows=256, min_cols=512):
+    """
+    Precomputes the decimated levels of a stored capture.
+
+    Level k is pooled 2x from level k - 1 (so a level never reads more than
+    twice its own size) and stored in the capture store as
+    `<name>.L<k>.<mode>`. The level factors are recorded in the capture's
+    sidecar under 'pyramid'. Note that repeated 2x median pooling is the
+    median of medians, an approximation of the median over the full cell.
+    """
+    data, meta = open_capture(store_folder, name)
+    levels = pyramid_levels(data.shape, min_rows, min_cols)
+    dtype = np.dtype(meta['dtype'])
+
+    for mode in modes:
+        previous = data
+        for level in range(1, len(levels)):
+            time_step = levels[level][0] // levels[level - 1][0]
+            freq_step = levels[level][1] // levels[level - 1][1]
+            shape = (-(-previous.shape[0] // time_step), -(-previous.shape[1] // freq_step))
+            # Written next to the old level and swapped in, so a concurrent
+            # reader keeps a complete (old) level until it reopens it
+            tmp_path = store_paths(store_folder, level_name(name, level, mode))[0] + '.tmp'
+            try:
+                out = np.memmap(tmp_path, dtype=dtype, mode='w+', shape=shape)
+                decimate(previous, time_step, freq_step, mode, out=out)
+                out.flush()
+                del out
+                publish(store_folder, level_name(name, level, mode), tmp_path, {
+                    'name': level_name(name, level, mode),
+                    'dtype': dtype.str,
+                    'shape': list(shape),
+                    'factors': list(levels[level]),
+                })
+            except BaseException:
+                discard(tmp_path)
+                raise
+            previous, _ = open_capture(store_folder, level_name(name, level, mode))
+
+    pyramid = meta.get('pyramid') or {'modes': []}
+    pyramid['levels'] = [list(factors) for factors in levels]
+    pyramid['modes'] = sorted(set(pyramid['modes']) | set(modes))
+    meta['pyramid'] = pyramid
+    write_meta(store_folder, name, meta)
+    return meta
+
+
+def open_level(store_folder, name, level, mode='max'):
+    """Opens pyramid `level` of a stored capture, level 0 being the capture itself."""
+    if level == 0:
+        return open_capture(store_folder, name)[0]
+    return open_capture(store_folder, level_name(name, level, mode))[0]
+
+
+def pick_level(levels, shape, max_rows, max_cols):
+    """
+    Index of the most detailed level whose size fits in max_rows x max_cols.
+
+    `levels` is the list of (time_factor, freq_factor) of the pyramid and
+    `shape` the shape of level 0. Falls back to the coarsest level.
+    """
+    for level, (time_factor, freq_factor) in enumerate(levels):
+        if -(-shape[0] // time_factor) <= max_rows and -(-shape[1] // freq_factor) <= max_cols:
+            return level
+    return len(levels) - 1
+
+
+def fit_factors(shape, max_rows, max_cols):
+    """Power of two (time_factor, freq_factor) that make `shape` fit in max_rows x max_cols."""
+    time_factor = 1
+    while -(-shape[0] // time_factor) > max_rows:
+        time_factor *= 2
+    freq_factor = 1
+    while -(-shape[1] // freq_factor) > max_cols:
+        freq_factor *= 2
+    return time_factor, freq_factor
+
+
+def remove_pyramid(store_folder, name):
+    """Deletes all the levels of a stored capture."""
+    meta = read_meta(store_folder, name)
+    pyramid = (meta or {}).get('pyramid')
+    if pyramid is None:
+        return
+    for mode in pyramid['modes']:
+        for level in range(1, len(pyramid['levels'])):
+            remove_capture(store_folder, level_name(name, level, mode))
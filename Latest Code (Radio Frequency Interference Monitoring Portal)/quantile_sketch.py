@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Streaming per-channel quantiles of a waterfall, from fixed-width histograms.
+
+    Every channel keeps a histogram of its dBm values over [lo, hi) in bins of
+    `bin_width` dB. Sweeps are added chunk by chunk with `update`, so medians
+    and percentiles of captures larger than RAM (or of live data) never need
+    the full matrix.
+
+    Error bound: `quantile` interpolates between the order statistics around
+    the requested rank like np.percentile / np.median, but with every sample
+    replaced by the centre of its bin. For values inside [lo, hi) the result
+    is therefore within bin_width / 2 of the exact np.percentile (0.025 dB
+    with the defaults). Values outside the range are counted in the first or
+    last bin; quantiles that fall there are only known to be <= lo or >= hi.
+    NaN samples are ignored.
+    """
+
+    def __init__(self, n_channels, lo=-160.0, hi=40.0, bin_width=0.05):
+        self.n_channels = n_channels
+        self.lo = lo
+        self.bin_width = bin_width
+        self.n_bins = int(round((hi - lo) / bin_width))
+        self.counts = np.zeros((n_channels, self.n_bins), dtype=np.uint32)
+        self.n_sweeps = 0
+
+    def update(self, chunk):
+        """Adds a (rows, n_channels) block of sweeps."""
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if chunk.ndim == 1:
+            chunk = chunk[np.newaxis, :]
+        if chunk.shape[1] != self.n_channels:
+            raise ValueError('Expected {} channels, got {}'.format(self.n_channels, chunk.shape[1]))
+        valid = ~np.isnan(chunk)
+        bins = np.clip(np.floor((np.where(valid, chunk, self.lo) - self.lo) / self.bin_width),
+                       0, self.n_bins - 1).astype(np.intp)
+        channels = np.broadcast_to(np.arange(self.n_channels), chunk.shape)
+        if len(chunk) < 64:
+            # A few sweeps (live data): scatter the increments directly
+            np.add.at(self.counts, (channels[valid], bins[valid]), 1)
+        else:
+            flat = channels[valid] * self.n_bins + bins[valid]
+            self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape).astype(np.uint32)
+        self.n_sweeps += len(chunk)
+
+    def merge(self, other):
+        """Adds the sweeps counted by another sketch with the same binning."""
+        self.counts += other.counts
+        self.n_sweeps += other.n_sweeps
+
+    def subtract(self, other):
+        """Removes the sweeps counted by another sketch with the same binning, e.g. a part of this one."""
+        self.counts -= other.counts
+        self.n_sweeps -= other.n_sweeps
+
+    def copy(self):
+        sketch = QuantileSketch.__new__(QuantileSketch)
+        sketch.__dict__.update(self.__dict__)
+        sketch.counts = self.counts.copy()
+        return sketch
+
+    def _values_at_rank(self, cumulative, rank):
+        # Centre of the bin holding the (0-based) rank-th smallest value of each channel
+        bins = (cumulative > rank[:, np.newaxis]).argmax(axis=1)
+        return self.lo + (bins + 0.5) * self.bin_width
+
+    def quantile(self, q):
+        """
+        Per-channel q-th percentile (0..100), NaN for channels without samples.
+
+        See the class docstring for the error bound against np.percentile.
+        """
+        cumulative = np.cumsum(self.counts, axis=1, dtype=np.int64)
+        n = cumulative[:, -1]
+        rank = (q / 100.0) * np.maximum(n - 1, 0)
+        below = np.floor(rank).astype(np.int64)
+        above = np.minimum(below + 1, np.maximum(n - 1, 0))
+        fraction = rank - below
+        low = self._values_at_rank(cumulative, below)
+        high = self._values_at_rank(cumulative, above)
+        result = low + fraction * (high - low)
+        result[n == 0] = np.nan
+        return result
+
+    def median(self):
+        return self.quantile(50)
+
+
+def sketch_capture(data, block_rows=16384, **kwargs):
+    """Builds a QuantileSketch over a (possibly memory-mapped) capture, block by block."""
+    sketch = QuantileSketch(data.shape[1], **kwargs)
+    for start in range(0, len(data), block_rows):
+        sketch.update(data[start:start + block_rows])
+    return sketch
+
+
+def row_median(data, block_rows=16384):
+    """Exact median of every sweep (row) of a capture, read block by block."""
+    result = np.empty(len(data), dtype=np.float64)
+    for start in range(0, len(data), block_rows):
+        result[start:start + block_rows] = np.median(data[start:start + block_rows], axis=1)
+    return result
@@ -0,0 +1,118 @@
+import glob
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+from plotly.colors import hex_to_rgb, sequential
+
+from capture_store import find_hdr, load_capture
+from pyramid import decimate, fit_factors
+from transfer import U8_NAN, quantize
+
+MISSING_COLOUR = (0, 0, 0)
+
+
+def colormap_lut(colours=sequential.Inferno, missing=MISSING_COLOUR):
+    """
+    256 entry RGB lookup table for `quantize` codes.
+
+    Entries 0..254 interpolate the colour scale (Plotly's Inferno, the one
+    used by the portal heatmaps) and entry U8_NAN is the colour of missing
+    samples.
+    """
+    anchors = np.array([hex_to_rgb(c) for c in colours], dtype=np.float64)
+    positions = np.linspace(0, 254, len(anchors))
+    codes = np.arange(255)
+    lut = np.empty((256, 3), dtype=np.uint8)
+    for channel in range(3):
+        lut[:255, channel] = np.rint(np.interp(codes, positions, anchors[:, channel]))
+    lut[U8_NAN] = missing
+    return lut
+
+
+INFERNO_LUT = colormap_lut()
+
+
+def colorize(z, zmin, zmax, lut=INFERNO_LUT):
+    """Maps a dBm matrix to an RGB image with one quantization and one table lookup."""
+    return lut[quantize(z, zmin, zmax)]
+
+
+def encode_png(rgb):
+    """Encodes an (rows, cols, 3) uint8 image as PNG, without any imaging library."""
+    rows, cols, _ = rgb.shape
+    # Filter type 0 (none) in front of every scanline
+    scanlines = np.zeros((rows, cols * 3 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgb.reshape(rows, cols * 3)
+
+    def chunk(kind, payload):
+        return (struct.pack('>I', len(payload)) + kind + payload +
+                struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', cols, rows, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def render_png(z, zmin=-90, zmax=-60, max_rows=None, max_cols=None, pooling='max', latest_on_top=False):
+    """
+    Renders a waterfall to PNG bytes.
+
+    The matrix is first max-pooled to fit max_rows x max_cols when given, so
+    the cost is bounded by the image size. Row 0 (the first sweep) is the
+    top line, as in the matplotlib plots, unless `latest_on_top` is set, as
+    needed to overlay the image on a Plotly axis that grows upwards.
+    """
+    if max_rows is not None and max_cols is not None:
+        time_factor, freq_factor = fit_factors(z.shape, max_rows, max_cols)
+        z = decimate(z, time_factor, freq_factor, pooling)
+    rgb = colorize(z, zmin, zmax)
+    if latest_on_top:
+        rgb = rgb[::-1]
+    return encode_png(np.ascontiguousarray(rgb))
+
+
+def render_directory(pattern, store_folder='Store', max_size=1024, zmin=-90, zmax=-60):
+    """
+    Writes a NAME_waterfall_thumb.png next to every capture CSV matching `pattern`.
+
+    A directory is taken as all the CSVs in it. Captures go through the
+    binary store, so rendering a directory again skips the CSV parsing.
+    A capture that cannot be read (e.g. a git-LFS pointer) is skipped.
+    Returns a list of (csv_path, seconds) timings and a list of
+    (csv_path, error) failures.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.csv')
+    timings = []
+    failures = []
+    for csv_path in sorted(glob.glob(pattern)):
+        start = time.time()
+        try:
+            hdr_path = find_hdr(csv_path)
+            hdr_content = open(hdr_path).read() if hdr_path else None
+            data, _ = load_capture(csv_path, store_folder, os.path.basename(csv_path), hdr_content=hdr_content)
+            png = render_png(data, zmin, zmax, max_rows=max_size, max_cols=max_size)
+            with open(os.path.splitext(csv_path)[0] + '_waterfall_thumb.png', 'wb') as f:
+                f.write(png)
+        except Exception as e:
+            failures.append((csv_path, str(e)))
+            continue
+        timings.append((csv_path, time.time() - start))
+    return timings, failures
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python raster.py <directory or glob> [max_size]")
+        sys.exit(1)
+    max_size = int(sys.argv[2]) if len(sys.argv) == 3 else 1024
+    timings, failures = render_directory(sys.argv[1], max_size=max_size)
+    for csv_path, seconds in timings:
+        print('{:8.2f} s  {}'.format(seconds, csv_path))
+    for csv_path, error in failures:
+        print('{}: skipped, {}'.format(csv_path, error))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,133 @@
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+
+from synth_capture import SyntheticSite
+
+IDN = 'Keysight Technologies,N9915A,SIM00000001,A.12.45'
+
+
+class SweepModel:
+    """Instrument settings and the synthetic spectrum it measures (see synth_capture.py)."""
+
+    def __init__(self, start_frequency=500e6, stop_frequency=6500e6, sweep_points=1001, seed=None):
+        self.seed = seed
+        self.configure(start_frequency, stop_frequency, sweep_points)
+
+    def configure(self, start_frequency, stop_frequency, sweep_points):
+        self.start_frequency = float(start_frequency)
+        self.stop_frequency = float(stop_frequency)
+        self.sweep_points = int(sweep_points)
+        self.site = SyntheticSite(self.sweep_points, seed=self.seed)
+        self.n_sweeps = 0
+
+    def sweep(self):
+        """One sweep of dBm values as float32."""
+        trace = self.site.sweeps(self.n_sweeps, 1)[0]
+        self.n_sweeps += 1
+        return trace
+
+
+class SimulatorState:
+    """Instrument settings shared by the connections of one simulator."""
+
+    def __init__(self, sweep_time=1.0, seed=None):
+        self.model = SweepModel(seed=seed)
+        self.sweep_time = float(sweep_time)
+        self.last_trace = None
+        self.lock = threading.Lock()
+
+    def command(self, command):
+        """Executes one SCPI command, returns the reply of a query or None."""
+        header, _, argument = command.strip().partition(' ')
+        header = header.upper()
+        model = self.model
+        with self.lock:
+            if header == '*IDN?':
+                return IDN
+            elif header in ('*OPC?', 'INIT:IMM;*OPC?'):
+                return '1'
+            elif header in ('*RST', '*CLS', 'INIT:CONT', 'FORM:DATA', 'FORM', 'INST:SEL'):
+                return None
+            elif header == 'SYST:ERR?':
+                return '+0,"No error"'
+            elif header in ('SENS:FREQ:STAR', 'FREQ:STAR'):
+                model.configure(float(argument), model.stop_frequency, model.sweep_points)
+            elif header in ('SENS:FREQ:STAR?', 'FREQ:STAR?'):
+                return repr(model.start_frequency)
+            elif header in ('SENS:FREQ:STOP', 'FREQ:STOP'):
+                model.configure(model.start_frequency, float(argument), model.sweep_points)
+            elif header in ('SENS:FREQ:STOP?', 'FREQ:STOP?'):
+                return repr(model.stop_frequency)
+            elif header in ('SENS:SWE:POIN', 'SWE:POIN'):
+                model.configure(model.start_frequency, model.stop_frequency, int(float(argument)))
+            elif header in ('SENS:SWE:POIN?', 'SWE:POIN?'):
+                return str(model.sweep_points)
+            elif header in ('SENS:SWE:TIME', 'SWE:TIME'):
+                self.sweep_time = float(argument)
+            elif header in ('SENS:SWE:TIME?', 'SWE:TIME?'):
+                return repr(self.sweep_time)
+            elif header in ('INIT', 'INIT:IMM'):
+                self.last_trace = model.sweep()
+            elif header in ('TRAC:DATA?', 'TRAC1:DATA?', 'TRACE:DATA?', 'TRACE1:DATA?'):
+                if self.last_trace is None:
+                    self.last_trace = model.sweep()
+                return ','.join(np.char.mod('%.2f', self.last_trace))
+            else:
+                return None
+        return None
+
+
+class ScpiHandler(socketserver.StreamRequestHandler):
+    # One line per command, ';' separates commands on a line, like the instrument
+
+    def handle(self):
+        state = self.server.state
+        for line in self.rfile:
+            replies = []
+            for command in line.decode('ascii', 'replace').strip().split(';'):
+                if not command:
+                    continue
+                if command.strip().upper() in ('INIT', 'INIT:IMM'):
+                    # A sweep takes the sweep time
+                    time.sleep(state.sweep_time)
+                reply = state.command(command)
+                if reply is not None:
+                    replies.append(reply)
+            if replies:
+                self.wfile.write((';'.join(replies) + '\n').encode('ascii'))
+
+
+class ScpiSimulator(socketserver.ThreadingTCPServer):
+    """
+    TCP SCPI server answering like a Keysight N9915A in spectrum analyzer
+    mode, for testing the acquisition without hardware. Use port 0 for a
+    free port, then read it from server_address.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=5025, sweep_time=1.0, seed=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), ScpiHandler)
+        self.state = SimulatorState(sweep_time, seed)
+
+    def start(self):
+        """Serves from a background thread, returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        print("Usage: python scpi_simulator.py [port] [sweep_time]")
+        sys.exit(1)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5025
+    sweep_time = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    server = ScpiSimulator('0.0.0.0', port, sweep_time)
+    print('Simulated {} listening on port {}'.format(IDN.split(',')[1], server.server_address[1]))
+    server.serve_forever()
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+EPOCH_SWEEPS = 4096  # Bursts are drawn per epoch, so any block of sweeps can be generated on its own
+
+
+class SyntheticSite:
+    """
+    Spectrum of a simulated RFI site, generated a block of sweeps at a time.
+
+    - a noise floor around -85 dBm, with a slope and a ripple across the band
+    - persistent narrowband carriers with a little level jitter
+    - intermittent bursts over a few percent of the band, lasting 1-60 sweeps
+    - carriers drifting across the whole band
+
+    Signals are added to the noise in linear power. Sweep k of the capture
+    only depends on the seed and k (apart from the noise), so blocks can be
+    generated in any order, e.g. by several processes.
+    """
+
+    def __init__(self, sweep_points=1001, seed=0, noise_floor=-85.0, n_carriers=None, burst_rate=0.05,
+                 n_drifting=2, drift_sweeps=3600):
+        self.sweep_points = sweep_points
+        # A different site on every run without a seed
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.burst_rate = burst_rate
+        self.drift_sweeps = drift_sweeps
+        self.rng = np.random.default_rng(self.seed)
+        position = np.linspace(0, 1, sweep_points, dtype=np.float32)
+        self.floor = noise_floor + 2.0 * position + 0.5 * np.sin(position * 40)
+        n_carriers = max(1, sweep_points // 100) if n_carriers is None else n_carriers
+        self.carriers = self.rng.choice(sweep_points, size=n_carriers, replace=False)
+        self.carrier_levels = self.rng.uniform(-75, -50, size=n_carriers).astype(np.float32)
+        self.drift_starts = self.rng.uniform(0, sweep_points, size=n_drifting)
+        self.drift_levels = self.rng.uniform(-75, -60, size=n_drifting).astype(np.float32)
+
+    def _bursts(self, epoch):
+        # (first sweep, last sweep, first channel, last channel, dBm) of the bursts starting in an epoch
+        rng = np.random.default_rng((self.seed, epoch))
+        n = rng.poisson(self.burst_rate * EPOCH_SWEEPS)
+        first = epoch * EPOCH_SWEEPS + rng.integers(0, EPOCH_SWEEPS, n)
+        width = np.maximum(1, (self.sweep_points * rng.uniform(0.01, 0.05, n)).astype(int))
+        channel = rng.integers(0, self.sweep_points, n)
+        return (first, first + rng.integers(1, 61, n), channel, np.minimum(channel + width, self.sweep_points),
+                rng.uniform(-75, -55, n))
+
+    def sweeps(self, start, n):
+        """Sweeps start..start + n as a (n, sweep_points) float32 dBm array."""
+        rows = np.arange(start, start + n)
+        noise = self.floor + self.rng.standard_normal((n, self.sweep_points), dtype=np.float32)
+        power = np.power(10, noise / 10, dtype=np.float32)
+
+        levels = self.carrier_levels + 0.5 * self.rng.standard_normal((n, len(self.carriers)), dtype=np.float32)
+        power[:, self.carriers] += np.power(10, levels / 10)
+
+        for offset, level in zip(self.drift_starts, self.drift_levels):
+            channels = ((offset + rows * (self.sweep_points / self.drift_sweeps)) % self.sweep_points).astype(int)
+            power[np.arange(n), channels] += 10 ** (level / 10)
+
+        # Bursts of this and the previous epoch may overlap the block (they last 60 sweeps at most)
+        for epoch in range(max(0, start // EPOCH_SWEEPS - 1), (start + n - 1) // EPOCH_SWEEPS + 1):
+            for first, last, low, high, level in zip(*self._bursts(epoch)):
+                if last > start and first < start + n:
+                    power[max(first - start, 0):min(last - start, n), low:high] += 10 ** (level / 10)
+
+        return 10 * np.log10(power)
+
+
+def value_table(lo=-200.0, hi=50.0, decimals=2):
+    """
+    Text of every dBm value on a 10**-decimals grid over [lo, hi], with a comma.
+
+    Returns (chars, lengths): a (n_values, width) uint8 array of the
+    right-padded strings and their lengths.
+    """
+    step = 10.0 ** -decimals
+    values = np.round(np.arange(int(round((hi - lo) / step)) + 1) * step + lo, decimals)
+    text = ['{:.{}f},'.format(v, decimals) for v in values]
+    width = max(len(t) for t in text)
+    chars = np.frombuffer(''.join(t.ljust(width) for t in text).encode('ascii'), dtype=np.uint8)
+    return chars.reshape(len(text), width), np.array([len(t) for t in text])
+
+
+def format_block(block, table, lo=-200.0, decimals=2):
+    """
+    CSV text of a block of sweeps, one line per sweep.
+
+    Every value is looked up in value_table and the strings are packed with
+    one boolean mask, so no Python loop runs over the values.
+    """
+    chars, lengths = table
+    codes = np.clip(np.rint((block - lo) * 10 ** decimals), 0, len(lengths) - 1).astype(np.intp)
+    text = chars[codes]
+    text_lengths = lengths[codes]
+    # The comma after the last value of a sweep becomes the newline
+    text[:, -1][np.arange(len(block)), text_lengths[:, -1] - 1] = ord('\n')
+    mask = np.arange(chars.shape[1]) < text_lengths[..., np.newaxis]
+    return text[mask].tobytes()
+
+
+def hdr_text(start_frequency, stop_frequency, sweep_points, sweep_time, started, n_sweeps):
+    """HDR file contents in the instrument's format."""
+    ended = time.localtime(time.mktime(started) + n_sweeps * sweep_time)
+    return '\n'.join([
+        'Instrument ID: Keysight Technologies,N9915A,SYNTHETIC,A.12.45',
+        '',
+        'System date: {},{},{}'.format(started.tm_year, started.tm_mon, started.tm_mday),
+        'Start frequency: {:d}'.format(int(start_frequency)),
+        'Stop frequency: {:d}'.format(int(stop_frequency)),
+        'Center frequency: {:d}'.format(int((start_frequency + stop_frequency) / 2)),
+        'Frequency span: {:d}'.format(int(stop_frequency - start_frequency)),
+        'Resolution BW: 3.000000E+05',
+        'Video BW: 1.5000000E+06',
+        'Sweep points: {}'.format(sweep_points),
+        'Sweep time: {:g}'.format(sweep_time),
+        'Data form: ASC,0',
+        'Start time: {},{},{}'.format(started.tm_hour, started.tm_min, started.tm_sec),
+        'End time: {},{},{}'.format(ended.tm_hour, ended.tm_min, ended.tm_sec),
+    ]) + '\n'
+
+
+def write_capture(csv_path, n_sweeps, sweep_points=1001, sweep_time=1.0, start_frequency=500e6,
+                  stop_frequency=6500e6, seed=0, block_rows=2048, started=None):
+    """
+    Writes a synthetic capture CSV of n_sweeps x sweep_points dBm values and
+    its NAME_hdr file. Returns the path of the HDR file.
+    """
+    site = SyntheticSite(sweep_points, seed=seed)
+    table = value_table()
+    with open(csv_path, 'wb') as f:
+        for start in range(0, n_sweeps, block_rows):
+            f.write(format_block(site.sweeps(start, min(block_rows, n_sweeps - start)), table))
+    hdr_path = os.path.splitext(csv_path)[0] + '_hdr'
+    with open(hdr_path, 'w') as f:
+        f.write(hdr_text(start_frequency, stop_frequency, sweep_points, sweep_time,
+                         started or time.localtime(), n_sweeps))
+    return hdr_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python synth_capture.py <output.csv> <duration_seconds> [sweep_points] [sweep_time]")
+        sys.exit(1)
+    sweep_points = int(sys.argv[3]) if len(sys.argv) > 3 else 1001
+    sweep_time = float(sys.argv[4]) if len(sys.argv) > 4 else 1.0
+    n_sweeps = int(float(sys.argv[2]) / sweep_time)
+    begin = time.time()
+    write_capture(sys.argv[1], n_sweeps, sweep_points, sweep_time)
+    seconds = time.time() - begin
+    size = os.path.getsize(sys.argv[1])
+    print('{} sweeps, {:.1f} MB in {:.1f} s ({:.0f} MB/s)'.format(n_sweeps, size / 1e6, seconds, size / 1e6 / seconds))
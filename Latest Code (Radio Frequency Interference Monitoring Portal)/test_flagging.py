@@ -0,0 +1,17 @@
+import numpy as np
+
+from flagging import channel_statistics, flag_block, flag_capture
+
+
+def test_flag_capture_blocks_match_one_pass():
+    rng = np.random.default_rng(1)
+    data = rng.normal(-90, 1, (4000, 300)).astype(np.float32)
+    # Bursts of all lengths and strengths, many of them across block boundaries
+    for _ in range(300):
+        row, col = rng.integers(0, 4000), rng.integers(0, 300)
+        data[row:row + rng.integers(1, 80), col:col + rng.integers(1, 20)] += rng.uniform(1, 8)
+    median, sigma = channel_statistics(data)
+
+    whole = flag_block(data, median, sigma)
+    for block_rows in [256, 1000]:
+        assert np.array_equal(flag_capture(data, median, sigma, block_rows=block_rows), whole)
@@ -0,0 +1,88 @@
+import hashlib
+
+import numpy as np
+
+from capture_store import open_capture
+from pyramid import decimate, open_level, pyramid_levels
+from time_axis import start_datetime
+
+TILE_ROWS = 256  # Sweeps per tile
+TILE_COLS = 256  # Channels per tile
+
+
+def capture_levels(meta):
+    """(time_factor, freq_factor) of every zoom level of a stored capture."""
+    if 'pyramid' in meta:
+        return [tuple(factors) for factors in meta['pyramid']['levels']]
+    return pyramid_levels(tuple(meta['shape']))
+
+
+def level_shape(meta, level):
+    """Shape of zoom `level` of a stored capture."""
+    rows, cols = meta['shape']
+    time_factor, freq_factor = capture_levels(meta)[level]
+    return -(-rows // time_factor), -(-cols // freq_factor)
+
+
+def tile_grid(meta, level):
+    """Number of tiles along time and frequency at zoom `level`."""
+    rows, cols = level_shape(meta, level)
+    return -(-rows // TILE_ROWS), -(-cols // TILE_COLS)
+
+
+def read_tile(store_folder, name, meta, level, t, f, mode='max'):
+    """
+    Reads tile (t, f) of zoom `level`, a TILE_ROWS x TILE_COLS block or less at the edges.
+
+    The tile is sliced from the precomputed pyramid level when there is one
+    for `mode`, otherwise it is pooled on demand from the matching block of
+    the full resolution capture. Either way only the pages under the tile
+    are read from disk. Raises IndexError for tiles outside the capture.
+    """
+    levels = capture_levels(meta)
+    if not 0 <= level < len(levels):
+        raise IndexError('No zoom level {}'.format(level))
+    n_t, n_f = tile_grid(meta, level)
+    if not (0 <= t < n_t and 0 <= f < n_f):
+        raise IndexError('No tile ({}, {}) at level {}'.format(t, f, level))
+
+    rows = slice(t * TILE_ROWS, (t + 1) * TILE_ROWS)
+    cols = slice(f * TILE_COLS, (f + 1) * TILE_COLS)
+    if level == 0 or mode in meta.get('pyramid', {}).get('modes', []):
+        return np.asarray(open_level(store_folder, name, level, mode)[rows, cols])
+
+    time_factor, freq_factor = levels[level]
+    data, _ = open_capture(store_folder, name)
+    block = data[rows.start * time_factor:rows.stop * time_factor, cols.start * freq_factor:cols.stop * freq_factor]
+    return decimate(block, time_factor, freq_factor, mode)
+
+
+def tile_etag(meta, level, t, f, mode, fmt):
+    """Strong ETag of a tile, it changes whenever the capture is converted again."""
+    key = '{}|{}|{}|{}|{}|{}|{}|{}|{}'.format(meta['name'], meta.get('source_size'), meta.get('source_mtime'),
+                                           meta['dtype'], level, t, f, mode, fmt)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def tile_info(meta):
+    """Everything the browser needs to address tiles and place them on the axes."""
+    hdr = meta.get('hdr') or {}
+    rows, cols = meta['shape']
+    has_frequencies = 'Start frequency' in hdr and 'Stop frequency' in hdr
+    info = {
+        'name': meta['name'],
+        'shape': [rows, cols],
+        'levels': [list(factors) for factors in capture_levels(meta)],
+        'modes': meta.get('pyramid', {}).get('modes', []),
+        'tile_rows': TILE_ROWS,
+        'tile_cols': TILE_COLS,
+        'f_start': hdr['Start frequency'] / 1e9 if has_frequencies else 0,
+        'f_stop': hdr['Stop frequency'] / 1e9 if has_frequencies else cols - 1,
+        'x_label': 'Frequency [GHz]' if has_frequencies else 'Channel',
+        't_start': None,
+        'sweep_time': hdr.get('Sweep time', 1),
+    }
+    if 'Start time' in hdr:
+        start = start_datetime(hdr['Start time'], hdr.get('System date'))
+        info['t_start'] = str(start.astype('datetime64[ms]'))
+    return info
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def start_datetime(start_time, system_date=None):
+    """
+    Absolute start of a capture from the HDR fields.
+
+    Parameters:
+    ----------
+    start_time : str
+        HDR "Start time", formatted HH,MM,SS.
+    system_date : str, optional
+        HDR "System date", formatted YYYY,M,D. Without it the capture is
+        placed on 1970-01-01 and only the time of day is meaningful.
+
+    Returns:
+    -------
+    numpy.datetime64 with microsecond resolution.
+    """
+    if system_date:
+        year, month, day = map(int, system_date.split(','))
+    else:
+        year, month, day = 1970, 1, 1
+    hr, min, sec = map(int, start_time.split(','))
+    date = np.datetime64('{:04d}-{:02d}-{:02d}'.format(year, month, day), 'us')
+    return date + np.timedelta64(hr * 3600 + min * 60 + sec, 's')
+
+
+def build_time_axis(n_sweeps, start_time, sweep_time, system_date=None, first_sweep=0):
+    """
+    Timestamps of every sweep as a datetime64[us] array.
+
+    Sweep i starts at start + i * sweep_time. The whole axis is built with
+    one NumPy multiply and add, so fractional sweep times keep distinct,
+    strictly increasing timestamps. `first_sweep` gives the axis of sweeps
+    first_sweep.. only.
+    """
+    start = start_datetime(start_time, system_date)
+    sweeps = np.arange(first_sweep, first_sweep + n_sweeps)
+    offsets_us = np.round(sweeps * (float(sweep_time) * 1e6)).astype('timedelta64[us]')
+    return start + offsets_us
+
+
+def tick_labels(time_axis, num_labels=8, fmt='%H,%M,%S'):
+    """
+    Evenly spaced tick positions and their formatted labels.
+
+    Only the `num_labels` displayed ticks are converted to strings.
+    Returns (indices, labels).
+    """
+    if len(time_axis) == 0:
+        return np.array([], dtype=int), []
+    indices = np.linspace(0, len(time_axis) - 1, num_labels, dtype=int)
+    labels = [t.strftime(fmt) for t in time_axis[indices].astype('datetime64[us]').tolist()]
+    return indices, labels
@@ -0,0 +1,80 @@
+import base64
+
+import numpy as np
+
+ENCODINGS = ('u8', 'f16', 'f32')
+U8_NAN = 255  # uint8 code of missing samples, 0..254 cover [zmin, zmax]
+
+
+def quantize(z, zmin, zmax):
+    """
+    Quantizes dBm values to uint8 against the colour range of the waterfall.
+
+    Values are clipped to [zmin, zmax] (the colour scale saturates there
+    anyway) and mapped to 0..254, a step of (zmax - zmin) / 254 dB, i.e.
+    0.12 dB for the portal's -90..-60 dBm range. NaN becomes U8_NAN.
+    """
+    z = np.asarray(z, dtype=np.float32)
+    scaled = (np.clip(z, zmin, zmax) - zmin) * (254.0 / (zmax - zmin))
+    q = np.rint(scaled).astype(np.uint8)
+    q[np.isnan(z)] = U8_NAN
+    return q
+
+
+def encode_matrix(z, encoding, zmin, zmax):
+    """
+    Packs a 2D matrix as base64 for the browser.
+
+    'u8' is quantized with `quantize`, 'f16' and 'f32' are little-endian
+    floats. Returns a dict with the encoding, the shape, the colour range
+    and the base64 data.
+    """
+    if encoding == 'u8':
+        raw = quantize(z, zmin, zmax)
+    elif encoding == 'f16':
+        raw = np.asarray(z).astype('<f2')
+    elif encoding == 'f32':
+        raw = np.asarray(z).astype('<f4')
+    else:
+        raise ValueError('Unknown transfer encoding: ' + str(encoding))
+    return {
+        'encoding': encoding,
+        'shape': list(raw.shape),
+        'zmin': zmin,
+        'zmax': zmax,
+        'data': base64.b64encode(np.ascontiguousarray(raw).tobytes()).decode('ascii'),
+    }
+
+
+def tile_bytes(tile, encoding, zmin, zmax):
+    """Raw bytes of a waterfall tile in one of ENCODINGS."""
+    if encoding == 'u8':
+        return quantize(tile, zmin, zmax).tobytes()
+    elif encoding == 'f16':
+        return np.ascontiguousarray(tile, dtype='<f2').tobytes()
+    elif encoding == 'f32':
+        return np.ascontiguousarray(tile, dtype='<f4').tobytes()
+    raise ValueError('Unknown transfer encoding: ' + str(encoding))
+
+
+def encode_axis(values):
+    """
+    Compact description of a plot axis.
+
+    Evenly spaced axes (every time axis and nearly every frequency axis)
+    become {'type', 'start', 'step', 'n'}, the step of a date axis being in
+    milliseconds. Anything else is sent as the full list of values.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        ms = (values - values[0]) / np.timedelta64(1, 'ms') if n else values
+        step = float(ms[1]) if n > 1 else 0.0
+        if n < 2 or np.allclose(ms, np.arange(n) * step):
+            return {'type': 'date', 'start': str(values[0].astype('datetime64[ms]')) if n else None, 'step': step, 'n': n}
+        return {'type': 'date', 'values': [str(v) for v in values.astype('datetime64[ms]')]}
+    values = values.astype(np.float64)
+    step = float(values[1] - values[0]) if n > 1 else 0.0
+    if n < 2 or np.allclose(values, values[0] + np.arange(n) * step, rtol=0, atol=abs(step) * 1e-6):
+        return {'type': 'linear', 'start': float(values[0]) if n else 0.0, 'step': step, 'n': n}
+    return {'type': 'linear', 'values': values.tolist()}
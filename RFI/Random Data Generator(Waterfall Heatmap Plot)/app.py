@@ -4,26 +4,36 @@ import numpy as np
 import plotly
 import plotly.graph_objs as go
 import json
-import time
+import os
+import threading
+from replay import CaptureReplay
 
 app = Flask(__name__)
+app.config['REPLAY_WINDOW'] = 200  # Latest replayed sweeps shown in the heatmap
 
 # Initial dataset file
 current_dataset = None
-fake_data_generator = None
-
-def generate_fake_data(dataset_filename):
-    """Generate fake data for demonstration and append to the dataset file."""
-    while True:
-        # Generate random data
-        fake_data = np.random.randint(50, 100, size=(10, 10))
-        
-        # Append the generated data to the dataset file
-        with open(dataset_filename, 'a') as file:
-            pd.DataFrame(fake_data).to_csv(file, header=False, index=False)
-        
-        yield fake_data.tolist()
-        time.sleep(1)  # Simulate 1 second delay
+capture_replay = None
+replayed = []  # Blocks of sweeps received from the replay
+replayed_lock = threading.Lock()
+
+def read_sweep_time(dataset_filename):
+    """Sweep time from the HDR file next to the capture (NAME_hdr), 1 second without one."""
+    base = os.path.splitext(dataset_filename)[0]
+    for path in [base + '_hdr', base + '_hdr.txt']:
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    if line.startswith('Sweep time:'):
+                        return float(line.split(':', 1)[1])
+    return 1.0
+
+def receive_sweeps(sweeps):
+    """Sink of the replay, keeps only the blocks needed for the displayed window."""
+    with replayed_lock:
+        replayed.append(sweeps)
+        while len(replayed) > 1 and sum(len(block) for block in replayed[1:]) >= app.config['REPLAY_WINDOW']:
+            replayed.pop(0)
 
 @app.route('/')
 def index():
@@ -32,7 +42,7 @@ def index():
 @app.route('/upload_dataset', methods=['POST'])
 def upload_dataset():
     global current_dataset
-    global fake_data_generator
+    global capture_replay
     
     # Check if the post request has the file part
     if 'file' not in request.files:
@@ -50,9 +60,19 @@ def upload_dataset():
     
     # Set current dataset to the uploaded file
     current_dataset = filename
+    data = pd.read_csv(filename, header=None).apply(pd.to_numeric, errors='coerce').dropna(how='all').to_numpy()
     
-    # Start the fake data generator with the uploaded file name
-    fake_data_generator = generate_fake_data(filename)
+    # Replay the recorded sweeps at `speed` times their Sweep time (1x, 10x, 100x)
+    if capture_replay is not None:
+        capture_replay.stop()
+    with replayed_lock:
+        del replayed[:]
+    try:
+        capture_replay = CaptureReplay(data, receive_sweeps, read_sweep_time(filename),
+                                       speed=float(request.form.get('speed', 1)), loop=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)})
+    capture_replay.start()
     
     # Send success message to frontend
     return jsonify({'success': 'Dataset ' + filename + ' uploaded successfully'})
@@ -60,15 +80,19 @@ def upload_dataset():
 @app.route('/visualize', methods=['GET'])
 def visualize():
     global current_dataset
-    global fake_data_generator
     
     # Check if dataset is loaded
     if current_dataset is None:
         return jsonify({'error': 'No dataset loaded'})
 
+    with replayed_lock:
+        blocks = list(replayed)
+    if not blocks:
+        return jsonify({'success': True, 'graphJSON': json.dumps({'data': [], 'layout': {}})})
+
     try:
-        # Generate the waterfall heatmap
-        rfi_data = next(fake_data_generator)  # Get the next generated fake data
+        # Generate the waterfall heatmap of the latest replayed sweeps
+        rfi_data = np.concatenate(blocks)[-app.config['REPLAY_WINDOW']:]
 
         # Create the heatmap trace
         trace = go.Heatmap(z=rfi_data,
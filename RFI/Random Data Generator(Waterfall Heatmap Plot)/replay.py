@@ -0,0 +1,91 @@
+import threading
+import time
+
+import numpy as np
+
+
+class CaptureReplay:
+    """
+    Feeds the sweeps of a recorded capture to `sink` at `speed` times real time.
+
+    Sweep i is due at start + i * sweep_time / speed. A background thread
+    wakes up when the next sweep is due and passes every sweep due by then
+    to sink() as one (rows, channels) block (at most `max_batch` sweeps),
+    so 100x replays of 1 s captures cost a hundred sink calls per second at
+    most and a slow sink gets larger blocks instead of falling further
+    behind. With `loop` the capture starts over at its end.
+
+    `data` is any 2D array of sweeps, e.g. the memmap of a stored capture.
+    """
+
+    def __init__(self, data, sink, sweep_time, speed=1.0, loop=False, max_batch=4096):
+        if sweep_time <= 0 or speed <= 0:
+            raise ValueError('Sweep time and speed must be positive')
+        if len(data) == 0:
+            raise ValueError('Nothing to replay')
+        self.data = data
+        self.sink = sink
+        self.sweep_time = float(sweep_time)
+        self.speed = float(speed)
+        self.loop = loop
+        self.max_batch = max_batch
+        self.sent = 0
+        self.max_lag = 0.0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _rows(self, start, stop):
+        # Sweeps start..stop of the (looped) capture
+        n = len(self.data)
+        if not self.loop:
+            return np.asarray(self.data[start:stop])
+        first, last = start % n, (stop - 1) % n + 1
+        if start // n == (stop - 1) // n:
+            return np.asarray(self.data[first:last])
+        return np.concatenate([self.data[first:], self.data[:last]])
+
+    def _run(self):
+        interval = self.sweep_time / self.speed
+        started = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                due = int((now - started) / interval) + 1
+                if not self.loop:
+                    due = min(due, len(self.data))
+                if due > self.sent:
+                    stop = min(due, self.sent + self.max_batch)
+                    self.max_lag = max(self.max_lag, now - (started + self.sent * interval))
+                    self.sink(self._rows(self.sent, stop))
+                    self.sent = stop
+                if not self.loop and self.sent >= len(self.data):
+                    break
+                self._stop.wait(max(0.0, started + self.sent * interval - time.monotonic()))
+        except Exception as e:
+            self.error = str(e)
+
+    def status(self):
+        return {
+            'running': self.running,
+            'sent': self.sent,
+            'rows': len(self.data),
+            'loops': self.sent // len(self.data),
+            'speed': self.speed,
+            'sweep_time': self.sweep_time,
+            'max_lag': self.max_lag,
+            'error': self.error,
+        }